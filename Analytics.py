@@ -0,0 +1,126 @@
+import threading #Provides a lock so several request threads can share the progress cache safely
+from collections import OrderedDict #A dictionary that remembers the order items were used in, which is what an LRU (least recently used) cache needs
+import numpy as np #Works on whole columns of numbers at once instead of looping over every workout in Python
+from sqlalchemy import select #Builds the query that loads a user's workouts
+from DB_Models import db, User, Workout #The table the progress is calculated from, and the user version stamp the cache is keyed on
+
+ROLLING_WEEKS = 4 #How many weeks the rolling average volume covers
+RECENT_RECORDS = 20 #How many of the newest personal records are returned
+
+def load_workouts(user_id): #Loads a user's workouts as columns (one NumPy array per field), oldest first
+    rows = db.session.execute(select(Workout.exercise, Workout.workout_date, Workout.sets, Workout.reps, Workout.weight).where(Workout.user_id == user_id).order_by(Workout.workout_date, Workout.id)).all() #Plain tuples are much quicker to load than full Workout objects
+    if not rows:
+        return None
+    exercises, dates, sets, reps, weights = zip(*rows) #Turns the list of rows into one tuple per column
+    names, exercise_codes = np.unique(np.array(exercises, dtype = object), return_inverse = True) #Gives each exercise name a number so exercises can be grouped with array operations
+    return {
+        "names": names,
+        "exercise": exercise_codes,
+        "date": np.array(dates, dtype = "datetime64[D]"),
+        "sets": np.array(sets, dtype = np.int64),
+        "reps": np.array(reps, dtype = np.int64),
+        "weight": np.array(weights, dtype = np.float64),
+    }
+
+def estimated_one_rep_max(weight, reps): #The Epley formula: weight x (1 + reps / 30). A single rep is the lift itself, and 0 reps counts as no lift
+    return np.where(reps > 1, weight * (1 + reps / 30.0), np.where(reps == 1, weight, 0.0))
+
+def group_running_max(values, groups): #The running maximum of values within each group. Rows must be sorted by group. Each group is lifted above the one before so one running maximum over the whole array never crosses groups
+    offset = groups * (values.max() + 1.0)
+    return np.maximum.accumulate(values + offset) - offset
+
+def compute_progress(columns, weeks = 12): #Calculates weekly volume, rolling volume, estimated one rep max and personal records for every exercise
+    names = columns["names"]
+    exercise = columns["exercise"]
+    dates = columns["date"]
+    volume = columns["sets"] * columns["reps"] * columns["weight"] #Volume of each workout: sets x reps x weight
+    e1rm = estimated_one_rep_max(columns["weight"], columns["reps"])
+    day_numbers = dates.astype(np.int64)
+    week_starts = day_numbers - (day_numbers + 3) % 7 #Days since 1970-01-01 (a Thursday) of the Monday each workout's week starts on
+    first_week = week_starts.min()
+    week_index = (week_starts - first_week) // 7
+    week_count = int(week_index.max()) + 1
+    exercise_count = len(names)
+
+    weekly_volume = np.bincount(exercise * week_count + week_index, weights = volume, minlength = exercise_count * week_count).reshape(exercise_count, week_count) #Volume per exercise per week, with empty weeks as 0
+    running_total = np.cumsum(weekly_volume, axis = 1)
+    rolling_volume = running_total.copy()
+    rolling_volume[:, ROLLING_WEEKS:] -= running_total[:, :-ROLLING_WEEKS] #The total of the last ROLLING_WEEKS weeks, using the difference of two running totals
+    rolling_volume /= np.minimum(np.arange(1, week_count + 1), ROLLING_WEEKS) #Turns the totals into averages (the first few weeks have fewer weeks to average over)
+
+    order = np.lexsort((np.arange(len(exercise)), exercise)) #Sorts by exercise, keeping workouts in date order within each exercise
+    sorted_exercise = exercise[order]
+    sorted_e1rm = e1rm[order]
+    best_so_far = group_running_max(sorted_e1rm, sorted_exercise)
+    first_of_group = np.r_[True, sorted_exercise[1:] != sorted_exercise[:-1]]
+    previous_best = np.where(first_of_group, -np.inf, np.r_[0.0, best_so_far[:-1]]) #The best before each workout within the same exercise
+    is_record = (sorted_e1rm > previous_best) & (sorted_e1rm > 0) #A personal record beats every earlier lift of the same exercise
+    record_rows = order[is_record]
+
+    best_e1rm = np.zeros(exercise_count)
+    np.maximum.at(best_e1rm, exercise, e1rm)
+    best_weight = np.zeros(exercise_count)
+    np.maximum.at(best_weight, exercise, columns["weight"])
+    total_volume = weekly_volume.sum(axis = 1)
+    record_count = np.bincount(exercise[record_rows], minlength = exercise_count)
+    last_record_day = np.full(exercise_count, np.iinfo(np.int64).min)
+    np.maximum.at(last_record_day, exercise[record_rows], day_numbers[record_rows])
+
+    shown_weeks = slice(max(week_count - weeks, 0), week_count) #Only the most recent weeks are returned
+    week_labels = [str(np.datetime64(int(first_week + 7 * index), "D")) for index in range(week_count)][shown_weeks]
+    summary = []
+    for code in np.argsort(-total_volume): #Exercises with the most volume first
+        summary.append({
+            "exercise": str(names[code]),
+            "total_volume": round(float(total_volume[code]), 1),
+            "best_e1rm": round(float(best_e1rm[code]), 1),
+            "best_weight": float(best_weight[code]),
+            "record_count": int(record_count[code]),
+            "last_record": str(np.datetime64(int(last_record_day[code]), "D")) if record_count[code] else None,
+            "weekly": [{"week_start": label, "volume": round(float(week_volume), 1), "rolling_volume": round(float(rolling), 1)} for label, week_volume, rolling in zip(week_labels, weekly_volume[code, shown_weeks], rolling_volume[code, shown_weeks])],
+        })
+    newest_records = record_rows[np.argsort(-day_numbers[record_rows], kind = "stable")][:RECENT_RECORDS]
+    records = [{"exercise": str(names[exercise[row]]), "date": str(dates[row]), "weight": float(columns["weight"][row]), "reps": int(columns["reps"][row]), "e1rm": round(float(e1rm[row]), 1)} for row in newest_records]
+    return {"workout_count": int(len(exercise)), "exercises": summary, "personal_records": records}
+
+class ProgressCache: #Remembers each user's calculated progress, keyed on their version stamp. Every change to a user's workouts bumps the stamp in the same transaction, so every worker process sees the change without being told
+    def __init__(self, max_users = 256):
+        self.max_users = max_users #The most users whose progress is kept in memory
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key) #Marks the item as the most recently used
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value): #key is (user_id, version, weeks). Results for the user's older versions can never be read again, so they are dropped
+        with self._lock:
+            for old_key in [old_key for old_key in self._entries if old_key[0] == key[0] and old_key[1] != key[1]]:
+                del self._entries[old_key]
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last = False) #Removes the least recently used user
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "max_entries": self.max_users}
+
+progress_cache = ProgressCache() #Shared by every request in this worker
+
+def user_progress(user_id, weeks = 12): #Returns a user's progress, calculating it only if it isn't cached
+    version = db.session.query(User.data_version).filter(User.id == user_id).scalar() #One primary key lookup. Read before the workouts, so a change saved in between gives a newer version and is calculated again on the next visit
+    key = (user_id, version, weeks)
+    progress = progress_cache.get(key)
+    if progress is None:
+        columns = load_workouts(user_id)
+        progress = compute_progress(columns, weeks = weeks) if columns else {"workout_count": 0, "exercises": [], "personal_records": []}
+        progress_cache.set(key, progress)
+    return progress
@@ -1,24 +1,174 @@
 import os #Allows python to interact with the operating system
-from flask import Flask, request, redirect, url_for, render_template, session, flash #Flask: a lightweight web framework for Python that allows the creation of PWA, request: Allows Python to access data sent by the user, redirect: Send the user to a different URL, url_for: Uses the name of a function to create a URL path, render_template: Allows the use of Jinja2 to develop dynamic HTML pages, session: Allows users to store data across multiple HTTP requests, flash: Provides messages to the user that they can view
-from DB_Models import db, User, Workout, CalorieEntry, Exercise, Favourite_Exercise, Review_Exercise #Imports all of the databases I created.
-from datetime import datetime #Datetime allows date and time to be viewed by the user
-from werkzeug.security import generate_password_hash, check_password_hash #Werkzeug allows the hashing of passwords. generate_password_hash creates a hash from a password and check_password_hash checks the password with the hashed versions to verify the account
-import pytz #A timezone database to convert to other timezones
+from flask import Flask, request, redirect, url_for, render_template, session, flash, abort, jsonify, Response, stream_with_context, send_from_directory #send_from_directory: Sends a file from a folder, Response: Builds a response by hand, stream_with_context: Lets a generator keep using the request while the response is being sent, jsonify: Turns a Python dictionary into a JSON response, abort: Stops a request early with an HTTP error code, Flask: a lightweight web framework for Python that allows the creation of PWA, request: Allows Python to access data sent by the user, redirect: Send the user to a different URL, url_for: Uses the name of a function to create a URL path, render_template: Allows the use of Jinja2 to develop dynamic HTML pages, session: Allows users to store data across multiple HTTP requests, flash: Provides messages to the user that they can view
+from DB_Models import db, User, Workout, CalorieEntry, Exercise, Favourite_Exercise, Review_Exercise, ExerciseRatingSummary, DailyCalorieRollup, WeeklyCalorieRollup, TrainerStats #Imports all of the databases I created.
+from datetime import date, datetime #Datetime allows date and time to be viewed by the user
+from Auth import hash_password, verify_password, needs_rehash, configure_hashing, HashingUnavailable, LoginRateLimiter #Password hashing runs in its own process pool, and failed logins are rate limited
+from sqlalchemy import tuple_ #tuple_: Builds a row-value comparison such as (date, id) < (?, ?) which SQLite can answer straight from an index
+from sqlalchemy.orm import joinedload #joinedload: Loads related rows in the same query instead of one extra query per row
+from Migrations import upgrade_database #Brings existing databases up to the current schema
+from markupsafe import Markup #Marks already-rendered HTML as safe so Jinja2 doesn't escape it a second time
+from Catalogue_Cache import CatalogueCache, row_to_dict #An in-memory cache for the exercise catalogue
+from Ratings import record_rating, summary_to_dict #Keeps the per-exercise rating totals up to date
+from Validation import validate_workout, validate_calories #The rules a workout or calorie entry has to pass before it's saved
+import io #Reads uploaded files as text
+import json #Reads the trainer's top exercises and recent reviews, which are stored as JSON
+import click #Builds the arguments of the command line tools
+from Bulk_IO import KINDS, guess_format, import_records, export_records #Streaming CSV/NDJSON import and export of workouts and calorie entries
+from Sync import sync_entries, SyncError #Saves the workouts and meals the service worker queued while the user was offline
+from Analytics import user_progress, progress_cache #Training progress (volume, estimated one rep max, personal records) calculated with NumPy
+from Search import search_exercises, FACETS #Full text search and filtering over the exercise catalogue
+from Rollups import local_time, is_valid_timezone, add_entry, remove_entry, rebuild_rollups, DEFAULT_TIMEZONE #Daily and weekly calorie totals in each user's own timezone
+from DB_Config import PROFILES, engine_options, install_pragmas #SQLite settings for development and production
+from Group_Commit import GroupCommitter #Saves writes from many requests in one transaction
+from Seed_Data import seed #Generates made-up data for benchmarks
+from Instrumentation import Metrics, instrument #Times every request and SQL statement for the /metrics route and the slow logs
+from Conditional import conditional, touch_user, user_stamp, similarity_stamp, rating_stamp, all_ratings_stamp, catalogue_stamp #ETag / Last-Modified support so unchanged pages are answered with 304 Not Modified
+from Recommendations import track_likes, rebuild_recommendations, similar_exercises, recommended_exercises #"Users who liked this also liked" and personal suggestions, precomputed from favourites and reviews
+from Trainer_Stats import exercise_added, favourite_changed, review_added, reconcile_in_batches, StatsReconciler, TOP_SHOWN #Per-trainer totals for the trainer dashboard, kept up to date as exercises, favourites and reviews are added
 app = Flask(__name__) #Creates the flask application
 basedir = os.path.abspath(os.path.dirname(__file__)) #\Turns the path into a fully resolved absolute path so that the program works on all operating systems. "__file__" relates to the full path of the file being executed. "os.path.dirname(__file__)" removes the file name 
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(basedir, "instance", "app.db") #Builds the file path while telling flask exactly where the database is located. "SQLite:///" informs Flask to use SQLite and create an absolute path. "os.path.join" builds the file path. This makes it so that the program works with any operating systems and resolves correctly every time.
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("FITFRESH_DATABASE_URL") or "sqlite:///" + os.path.join(basedir, "instance", "app.db") #FITFRESH_DATABASE_URL lets benchmarks use their own database file. Builds the file path while telling flask exactly where the database is located. "SQLite:///" informs Flask to use SQLite and create an absolute path. "os.path.join" builds the file path. This makes it so that the program works with any operating systems and resolves correctly every time.
 app.config["SECRET_KEY"] = "oJvneTznic84TgELjsKA" #This is a secret key used by flask to lock the login sessions so that people with no knowledge of the key cant access important information and tamper with cookies.
+app.config["DB_PROFILE"] = os.environ.get("FITFRESH_DB_PROFILE", "development") #"production" turns on WAL mode and the other SQLite settings in DB_Config.py
+if app.config["DB_PROFILE"] not in PROFILES:
+    raise RuntimeError(f"Unknown FITFRESH_DB_PROFILE {app.config['DB_PROFILE']!r}, use one of: {', '.join(PROFILES)}")
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["DB_PROFILE"]) #Connection pool settings, which have to be set before the database is connected
 db.init_app(app) #Connects the database to the app
+with app.app_context():
+    install_pragmas(db.engine, app.config["DB_PROFILE"]) #Applies the profile's PRAGMA settings to every new connection
+app.config["GROUP_COMMIT"] = os.environ.get("FITFRESH_GROUP_COMMIT") == "1" #When on, workouts, meals, favourites and reviews from requests arriving at the same time are saved in one transaction
+group_committer = GroupCommitter(app) if app.config["GROUP_COMMIT"] else None
+app.config["SLOW_QUERY_MS"] = float(os.environ.get("FITFRESH_SLOW_QUERY_MS", 100)) #SQL statements slower than this are logged with their route
+app.config["SLOW_REQUEST_MS"] = float(os.environ.get("FITFRESH_SLOW_REQUEST_MS", 500)) #Requests slower than this are logged with their query count and SQL time
+metrics = Metrics() #Request latency, queries per request and SQL time for each route in this worker
+with app.app_context():
+    instrument(app, db.engine, metrics, slow_query_ms = app.config["SLOW_QUERY_MS"], slow_request_ms = app.config["SLOW_REQUEST_MS"])
 
-def local_time(utc_dt): #A function that Converts UTC to Sydney Time
-    local_tz = pytz.timezone("Australia/Sydney") #The timezone it converts to is Sydney, Australia
-    return utc_dt.replace(tzinfo=pytz.utc).astimezone(local_tz) #Replaces UTC with the timezone of Sydney Australia
+def save(job, user_id = None): #Runs a write and commits it. job is a function that takes the database session and makes its changes. With group commit on, the write joins the next group transaction instead. user_id is the user whose data changes, so their version stamp is bumped in the same transaction
+    if user_id is not None:
+        change = job
+        def job(db_session):
+            result = change(db_session)
+            touch_user(db_session, user_id)
+            return result
+    if group_committer:
+        return group_committer.run(job)
+    result = job(db.session)
+    db.session.commit()
+    return result
+app.config["TRAINER_STATS_RECONCILE_SECONDS"] = int(os.environ.get("FITFRESH_TRAINER_STATS_RECONCILE_SECONDS", 0)) #How often this worker recalculates the trainer totals from the tables in the background. Off (0) by default, since every worker would run its own; with several workers run "flask --app App reconcile-trainer-stats" from cron instead
+stats_reconciler = StatsReconciler(app, app.config["TRAINER_STATS_RECONCILE_SECONDS"]) if app.config["TRAINER_STATS_RECONCILE_SECONDS"] > 0 else None
+
+@app.before_request
+def start_background_jobs(): #Starts the trainer totals reconciliation the first time this worker handles a request, so command line tools don't start it
+    if stats_reconciler:
+        stats_reconciler.start()
+DEFAULT_PAGE_SIZE = 25 #How many history rows are shown on one page
+MAX_PAGE_SIZE = 100 #The largest page a user can ask for, so one request can't load their entire history
+app.config["AUTH_HASH_WORKERS"] = int(os.environ.get("AUTH_HASH_WORKERS", 0)) or None #How many processes can hash passwords at once. None uses half of the CPU cores
+app.config["LOGIN_MAX_ATTEMPTS_PER_USER"] = 5 #Failed logins allowed for one username within the window
+app.config["LOGIN_MAX_ATTEMPTS_PER_IP"] = 50 #Failed logins allowed from one IP address within the window
+app.config["LOGIN_ATTEMPT_WINDOW"] = 300 #How many seconds a failed login is remembered for
+configure_hashing(max_workers = app.config["AUTH_HASH_WORKERS"])
+login_limiter = LoginRateLimiter(max_per_username = app.config["LOGIN_MAX_ATTEMPTS_PER_USER"], max_per_ip = app.config["LOGIN_MAX_ATTEMPTS_PER_IP"], window_seconds = app.config["LOGIN_ATTEMPT_WINDOW"])
+app.config["CATALOGUE_CACHE_SIZE"] = 512 #How many catalogue items each worker keeps in memory
+catalogue_cache = CatalogueCache(os.path.join(basedir, "instance", "catalogue.version"), max_entries = app.config["CATALOGUE_CACHE_SIZE"]) #Shared by every request in this worker. The version file keeps several workers consistent
+catalogue_version = catalogue_stamp(catalogue_cache) #The catalogue's version stamp for ETags, read from the version file without a query
+
+def load_exercise(exercise_id): #Returns an exercise and its rating summary as a dictionary. The exercise comes from the catalogue cache, only querying the database on a miss, and the summary is read each time so a new review doesn't reload the cache
+    def load():
+        exercise = db.session.get(Exercise, exercise_id)
+        return row_to_dict(exercise) if exercise else None
+    exercise = catalogue_cache.get_or_load(("exercise", exercise_id), load)
+    if exercise is None:
+        return None
+    return {**exercise, **summary_to_dict(db.session.get(ExerciseRatingSummary, exercise_id))} #One primary key lookup
+
+def exercise_list(): #Returns every exercise with its rating summary. The exercises come from the catalogue cache, only querying the database on a miss, and the summaries are read each time
+    exercises = catalogue_cache.get_or_load(("exercise_list", ), lambda: [row_to_dict(exercise) for exercise in Exercise.query.order_by(Exercise.id).all()])
+    summaries = {summary.exercise_id: summary for summary in ExerciseRatingSummary.query.all()} #One small row per reviewed exercise
+    return [{**exercise, **summary_to_dict(summaries.get(exercise["id"]))} for exercise in exercises]
+
+def exercise_grid(): #Returns the rendered exercise grid, only querying the database and rendering the template on a miss. The grid shows the ratings, so it's stored under the current rating stamp and a new review only re-renders the grid
+    ratings_version = all_ratings_stamp()[0]
+    return catalogue_cache.get_or_load(("exercise_grid", ratings_version), lambda: Markup(render_template("exercise_grid.html", exercises = exercise_list())))
+
+def user_timezone(): #Returns the logged-in user's timezone, remembering it in the session so the database is only asked once. Only used for showing times, since the user could have changed it from another device
+    if "timezone" not in session:
+        user = db.session.get(User, session["user_id"])
+        session["timezone"] = user.timezone if user else DEFAULT_TIMEZONE
+    return session["timezone"]
+
+def stored_timezone(db_session, user_id): #Reads the user's timezone from the table. Calorie writes call this after their first change, which takes SQLite's write lock, so a timezone change from another device can't slip in between and leave the totals counted in the old one
+    return db_session.query(User.timezone).filter(User.id == user_id).scalar() or DEFAULT_TIMEZONE
+
+def keyset_page(query, date_column, id_column, parse_cursor): #Returns one page of a history query, newest first, plus the cursor for the next (older) page
+    per_page = min(max(request.args.get("per_page", DEFAULT_PAGE_SIZE, type = int), 1), MAX_PAGE_SIZE) #Keeps the page size between 1 and MAX_PAGE_SIZE
+    before = request.args.get("before") #The date of the last row on the previous page
+    before_id = request.args.get("before_id", type = int) #The id of the last row on the previous page, used to break ties between rows on the same date
+    if before and before_id is not None:
+        try:
+            cursor_date = parse_cursor(before)
+        except ValueError: #A cursor that isn't a valid date returns HTTP 400 (Bad Request)
+            abort(400)
+        query = query.filter(tuple_(date_column, id_column) < tuple_(cursor_date, before_id)) #Only rows older than the cursor. The index lets SQLite seek straight to them instead of skipping over the newer ones
+    rows = query.order_by(date_column.desc(), id_column.desc()).limit(per_page + 1).all() #Fetches one extra row to find out whether an older page exists
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last_row = rows[-1]
+        next_cursor = {"before": getattr(last_row, date_column.key).isoformat(), "before_id": last_row.id, "per_page": per_page} #The query string for the "Older" link
+    return rows, next_cursor
+
+def calorie_page(user_id): #One page of the user's calorie entries in their local time, plus their recent daily and weekly totals
+    entries, next_cursor = keyset_page(CalorieEntry.query.filter_by(user_id = user_id), CalorieEntry.entry_date, CalorieEntry.id, datetime.fromisoformat) #Calories are sorted by the date that they are added (descending), one page at a time
+    timezone_name = user_timezone()
+    for entry in entries: #Loop converts each entry's UTC to local time and stores it in a variable
+        entry.local_time = local_time(entry.entry_date, timezone_name)
+    daily_totals = DailyCalorieRollup.query.filter_by(user_id = user_id).order_by(DailyCalorieRollup.local_date.desc()).limit(14).all() #The last 14 days with meals, read from the stored totals instead of adding up every entry
+    weekly_totals = WeeklyCalorieRollup.query.filter_by(user_id = user_id).order_by(WeeklyCalorieRollup.week_start.desc()).limit(8).all() #The last 8 weeks with meals
+    return entries, next_cursor, daily_totals, weekly_totals, timezone_name
+
+def review_page(exercise_id): #One page of an exercise's reviews, newest first, plus the cursor for the next (older) page
+    per_page = min(max(request.args.get("per_page", DEFAULT_PAGE_SIZE, type = int), 1), MAX_PAGE_SIZE) #Keeps the page size between 1 and MAX_PAGE_SIZE
+    reviews_query = Review_Exercise.query.options(joinedload(Review_Exercise.user)).filter_by(exercise_id = exercise_id) #Loads each review's author in the same query so the template doesn't run one query per review
+    before_id = request.args.get("before_id", type = int) #The id of the last review on the previous page
+    if before_id is not None:
+        reviews_query = reviews_query.filter(Review_Exercise.id < before_id)
+    reviews = reviews_query.order_by(Review_Exercise.id.desc()).limit(per_page + 1).all() #Newest reviews first. Fetches one extra review to find out whether an older page exists
+    next_cursor = None
+    if len(reviews) > per_page:
+        reviews = reviews[:per_page]
+        next_cursor = {"before_id": reviews[-1].id, "per_page": per_page} #The query string for the "Older reviews" link
+    return reviews, next_cursor
+
+def is_favourite_exercise(exercise_id): #Whether the logged-in user has favourited the exercise
+    if "user_id" not in session:
+        return False
+    return Favourite_Exercise.query.filter_by(user_id = session["user_id"], exercise_id = exercise_id).first() is not None
+
+def favourite_exercises(user_id): #The exercises the user has favourited
+    return db.session.query(Exercise).join(Favourite_Exercise, Favourite_Exercise.exercise_id == Exercise.id).filter(Favourite_Exercise.user_id == user_id) #Selects data from the exercise table and joins it to the favourite_exercise table and filters the data to the ones only the logged-in users can view
+
+def json_row(row): #A database row as a dictionary that can be sent as JSON, with dates in ISO format
+    return {key: value.isoformat() if isinstance(value, (date, datetime)) else value for key, value in row_to_dict(row).items()}
 
 #Home Page
 @app.route("/") #Tells flask to run the function below this decorator when someone visits the url
 def home(): #The function that runs when someone visits the url
     return render_template("home.html") #Loads an html file from the templates folder
 
+#The service worker and manifest that make the site work as an installable, offline-capable PWA. The service worker is served from the root so it can control every page
+@app.route("/service_worker.js") #Tells flask to run the function below this decorator when someone visits the url
+def service_worker(): #The function that runs when someone visits the url
+    response = send_from_directory(basedir, "service_worker.js", mimetype = "application/javascript")
+    response.headers["Cache-Control"] = "no-cache" #The browser always checks for a new version of the service worker
+    return response
+
+@app.route("/manifest.json") #Tells flask to run the function below this decorator when someone visits the url
+def manifest(): #The function that runs when someone visits the url
+    return send_from_directory(basedir, "manifest.json", mimetype = "application/manifest+json")
+
 #Register page where a new user can create an account
 @app.route("/register", methods=["GET", "POST"]) #Tells flask to run the function below this decorator when someone visits the url. The route can respond to both GET requests (occurs when the user loads the page) and POST requests (occurs when the user submits a form)
 def register_page():  #The function that runs when someone visits the url
@@ -34,7 +184,10 @@ def register_page():  #The function that runs when someone visits the url
     if existing_user: #Prevents duplicate accounts to avoid ambiguity and allow the databases to be unique.
         flash("Username already exists") #Showcases a message to the user
         return redirect(url_for("register_page")) #Redirects the user to a particular page
-    hashed_password = generate_password_hash(password) #Generates a secure hash from the password
+    try:
+        hashed_password = hash_password(password) #Generates a secure hash from the password in the hashing pool
+    except HashingUnavailable: #Every hashing slot is busy. Returns HTTP 503 (Service Unavailable) instead of queueing the request
+        return "The server is busy, please try again", 503
     #Creates and saves the information to the respective table
     new_user = User(username=username, password_hash=hashed_password, role=role)
     db.session.add(new_user) 
@@ -52,14 +205,30 @@ def login(): #The function that runs when someone visits the url
     password = request.form.get("password")
     if not username or not password:
         return "Please fill in all the fields", 400 #Stops empty submissions to prevent incomplete database records. Also returns HTTP 400 (Bad Request)
+    if login_limiter.is_blocked(username, request.remote_addr): #Turns away usernames and IP addresses with too many recent failed logins before the database or the hashing pool is used
+        return "Too many failed login attempts, please try again later", 429 #429 Error indicates that the user has sent too many requests
     user =  User.query.filter_by(username=username).first() #Checks if the username matches
     if not user: #If no account exists with the username, the PWA doesn't allows them to log in
+        login_limiter.record_failure(username, request.remote_addr)
         flash("Invalid username or password") #Showcases a message to the user
         return redirect(url_for("login")) #Redirects the user to a particular page
-    if not check_password_hash(user.password_hash, password): #Checks the hashed password with the user table and compares the plaintext and hashed versions to see if the password is correct
+    try:
+        password_matches = verify_password(password, user.password_hash) #Checks the hashed password with the user table and compares the plaintext and hashed versions to see if the password is correct
+    except HashingUnavailable: #Every hashing slot is busy. Returns HTTP 503 (Service Unavailable) instead of queueing the request
+        return "The server is busy, please try again", 503
+    if not password_matches:
+        login_limiter.record_failure(username, request.remote_addr)
         return "Invalid username or password", 401 #401 Error indicates that the request failed due to unauthorised credentials.
+    login_limiter.reset(username)
+    if needs_rehash(user.password_hash): #If the hash settings have changed since the password was saved, the password is hashed again with the new settings while the plaintext is available
+        try:
+            user.password_hash = hash_password(password)
+            db.session.commit()
+        except HashingUnavailable: #The upgrade isn't urgent, so it's tried again on the next login
+            pass
     session["user_id"] = user.id #Stores the user's unique ID allowing easy identification of the logged-in user
     session["role"] = user.role #Stores the role of the user to enable role-based access control
+    session["timezone"] = user.timezone #Stores the user's timezone so calorie times can be shown in local time
     #Based on the user's role, they're redirected to a particular dashboard
     if user.role == "gym_goer": 
         flash("Logged in successfully") #Showcases a message to the user
@@ -76,7 +245,9 @@ def gym_goer_dashboard(): #The function that runs when someone visits the url
         return redirect(url_for("home")) #Redirects the user to a particular page
     if session.get("role") != "gym_goer": #If they are not a gym goer they are shown an error message
         return "Only gym goers can access the dashboard", 403 #403 Error indicates that the user is unauthorised from accessing the information
-    return render_template("gym_goer_dashboard.html") #Returns the page, displaying it to the user
+    progress = user_progress(session["user_id"]) #The user's training progress, calculated once and then reused until their data changes
+    suggestions = recommended_exercises(db.session, session["user_id"]) #Exercises the user might like, worked out when their likes change
+    return render_template("gym_goer_dashboard.html", progress = progress, suggestions = suggestions) #Returns the page, displaying it to the user
 
 #The dashboard for gym_goers where they can access features only accessible to them
 @app.route("/personal-trainer-dashboard") #Tells flask to run the function below this decorator when someone visits the url.
@@ -85,7 +256,10 @@ def personal_trainer_dashboard():  #The function that runs when someone visits t
         return redirect(url_for("home")) #Redirects the user to a particular page
     if session.get("role") == "gym_goer": #If they are a gym goer they are shown an error message
         return "Only personal trainers can access the dashboard", 403 #403 Error indicates that the user is unauthorised from accessing the information
-    return render_template("personal_trainer_dashboard.html") #Returns the page, displaying it to the user
+    stats = db.session.get(TrainerStats, session["user_id"]) or TrainerStats(trainer_id = session["user_id"], exercise_count = 0, favourite_count = 0, review_count = 0, rating_sum = 0, diet_count = 0, routine_count = 0, **{f"star_{stars}": 0 for stars in range(1, 6)}) #One precomputed row, however many exercises the trainer has. Trainers with nothing yet get empty totals
+    top_exercises = json.loads(stats.top_exercises or "[]")[:TOP_SHOWN]
+    recent_reviews = json.loads(stats.recent_reviews or "[]")
+    return render_template("personal_trainer_dashboard.html", stats = stats, top_exercises = top_exercises, recent_reviews = recent_reviews) #Returns the page, displaying it to the user
 
 #A feature where users can log workouts
 @app.route("/log-workout", methods=["GET", "POST"]) #Tells flask to run the function below this decorator when someone visits the url. The route can respond to both GET requests (occurs when the user loads the page) and POST requests (occurs when the user submits a form)
@@ -94,33 +268,22 @@ def log_workout(): #The function that runs when someone visits the url
         return redirect(url_for("home")) #Redirects the user to a particular page
     if request.method == "GET":  #What happens when it's a GET request
         return render_template("log_workout.html") #Returns the page, displaying it to the user
-    #Requests the following values to send to the server from the website
-    exercise = request.form.get("exercise")
-    sets = request.form.get("sets")
-    reps = request.form.get("reps")
-    weight = request.form.get("weight")
-    #Stops empty / wrong submissions to prevent incomplete / incorrect database records. Also returns HTTP 400 (Bad Request)
-    if not exercise or not sets or not reps or not weight:
-        return "Please fill in all the fields", 400
-    if int(sets) < 0:
-        return "Sets must be positive", 400
-    if int(reps) < 0:
-        return "Reps must be positive", 400
-    if float(weight) < 0:
-        return "Weight must be positive", 400
+    values, error = validate_workout(request.form) #Requests the exercise, sets, reps and weight sent from the website and checks them
+    if error: #Stops empty / wrong submissions to prevent incomplete / incorrect database records. Also returns HTTP 400 (Bad Request)
+        return error, 400
     #Creates and saves the information to the respective table
-    workout = Workout(user_id = session["user_id"], exercise = exercise, sets = int(sets), reps = int(reps), weight = float(weight))
-    db.session.add(workout)
-    db.session.commit()
+    user_id = session["user_id"]
+    save(lambda db_session: db_session.add(Workout(user_id = user_id, **values)), user_id = user_id) #Bumping the user's version also means their progress is calculated again
     return redirect(url_for("workout_history")) #Returns the page, displaying it to the user
 
 #The place where the user can see their workout history (all the workouts they have logged)
 @app.route("/workout-history") #Tells flask to run the function below this decorator when someone visits the url.
+@conditional(user_stamp) #Answers 304 Not Modified if the user's data hasn't changed since their last visit
 def workout_history(): #The function that runs when someone visits the url
     if "user_id" not in session:  #Redirects the user to the home page if their details are not found in the database
         return redirect(url_for("home")) #Redirects the user to a particular page
-    workouts = Workout.query.filter_by(user_id = session["user_id"]).order_by(Workout.workout_date.desc()).all() #Workouts are sorted by the date that they are added (descending)
-    return render_template("workout_history.html", workouts = workouts) # Returns the page, displaying it to the user. The template can loop, showcasing each piece of data
+    workouts, next_cursor = keyset_page(Workout.query.filter_by(user_id = session["user_id"]), Workout.workout_date, Workout.id, date.fromisoformat) #Workouts are sorted by the date that they are added (descending), one page at a time
+    return render_template("workout_history.html", workouts = workouts, next_cursor = next_cursor) # Returns the page, displaying it to the user. The template can loop, showcasing each piece of data
 
 #The page where the user can log calories
 @app.route("/log-calories", methods = ["GET", "POST"])  #Tells flask to run the function below this decorator when someone visits the url. The route can respond to both GET requests (occurs when the user loads the page) and POST requests (occurs when the user submits a form)
@@ -129,29 +292,27 @@ def log_calories(): #The function that runs when someone visits the url
         return redirect(url_for("home")) #Redirects the user to a particular page
     if request.method == "GET": #What happens when it's a GET request
         return render_template("log_calories.html") #Returns the page, displaying it to the user
-    #Requests the following values to send to the server from the website
-    meal = request.form.get("meal")
-    calories = request.form.get("calories")
-    #Stops empty / wrong submissions to prevent incomplete / incorrect database records. Also returns HTTP 400 (Bad Request)
-    if not calories or not meal:
-        return "Please fill in all the fields", 400
-    if float(calories) < 0:
-        return "Calories must be positive", 400
+    values, error = validate_calories(request.form) #Requests the meal and calories sent from the website and checks them
+    if error: #Stops empty / wrong submissions to prevent incomplete / incorrect database records. Also returns HTTP 400 (Bad Request)
+        return error, 400
     #Creates and saves the information to the respective table
-    calorie_entry = CalorieEntry(user_id = session["user_id"], meal = meal, calories = float(calories))
-    db.session.add(calorie_entry)
-    db.session.commit()
+    user_id = session["user_id"]
+    def write(db_session):
+        calorie_entry = CalorieEntry(user_id = user_id, entry_date = datetime.utcnow(), **values)
+        db_session.add(calorie_entry)
+        db_session.flush() #Saves the entry first so the timezone is read inside the write transaction
+        add_entry(db_session, user_id, stored_timezone(db_session, user_id), calorie_entry.entry_date, calorie_entry.calories) #Adds the meal to the daily and weekly totals in the same transaction
+    save(write, user_id = user_id)
     return redirect(url_for("calorie_history")) #Redirects the user to a particular page
 
 #The place where the user can see their calorie history (all the calories they have tracked)
 @app.route("/calorie-history") #Tells flask to run the function below this decorator when someone visits the url.
+@conditional(user_stamp) #Answers 304 Not Modified if the user's data hasn't changed since their last visit
 def calorie_history(): #The function that runs when someone visits the url
     if "user_id" not in session: #Redirects the user to the home page if their details are not found in the database
         return redirect(url_for("home")) #Redirects the user to a particular page
-    entries = CalorieEntry.query.filter_by(user_id = session["user_id"]).order_by(CalorieEntry.entry_date.desc()).all() #Calories are sorted by the date that they are added (descending)
-    for entry in entries: #Loop converts each entry's UTC to local time and stores it in a variable
-        entry.local_time = local_time(entry.entry_date)
-    return render_template("calorie_tracker.html", entries = entries) # Returns the page, displaying it to the user. The template can loop, showcasing each piece of data
+    entries, next_cursor, daily_totals, weekly_totals, timezone_name = calorie_page(session["user_id"])
+    return render_template("calorie_tracker.html", entries = entries, next_cursor = next_cursor, daily_totals = daily_totals, weekly_totals = weekly_totals, timezone_name = timezone_name) # Returns the page, displaying it to the user. The template can loop, showcasing each piece of data
 
 #A page to allows users to edit their data
 @app.route("/edit-workout/<int:workout_id>", methods = ["GET", "POST"]) #Tells flask to run the function below this decorator when someone visits the url. The route can respond to both GET requests (occurs when the user loads the page) and POST requests (occurs when the user submits a form). This is a dynamic route based on the id of the object
@@ -163,11 +324,13 @@ def edit_workout(workout_id): #The function that runs when someone visits the ur
         return "Unauthorised user", 403 #403 Error indicates that the user is unauthorised from accessing the information
     if request.method == "GET": #What happens when it's a GET request
         return render_template("edit_workout.html", workout = workout) # Returns the page, displaying it to the user. The template can loop, showcasing each piece of data
-    #Requests the following values to send to the server from the database
-    workout.exercise = request.form.get("exercise")
-    workout.sets = int(request.form.get("sets"))
-    workout.reps = int(request.form.get("reps"))
-    workout.weight = float(request.form.get("weight"))
+    values, error = validate_workout(request.form) #Requests the exercise, sets, reps and weight sent from the website and checks them with the same rules as a new workout
+    if error: #Stops empty / wrong submissions to prevent incomplete / incorrect database records. Also returns HTTP 400 (Bad Request)
+        return error, 400
+    #Updates the workout with the checked values
+    for column, value in values.items():
+        setattr(workout, column, value)
+    touch_user(db.session, workout.user_id) #The user's pages get a new ETag and their progress is calculated again
     #Saves the information to the respective table
     db.session.commit() 
     flash("Workout Updated") #Showcases a message to the user
@@ -183,6 +346,7 @@ def delete_workout(workout_id): #The function that runs when someone visits the
         return "Unauthorised user", 403 #403 Error indicates that the user is unauthorised from accessing the information
     #Deletes the information from the respective table and saves the new one
     db.session.delete(workout)
+    touch_user(db.session, workout.user_id) #The user's pages get a new ETag and their progress is calculated again
     db.session.commit()
     flash("Workout Deleted") #Showcases a message to the user
     return redirect(url_for("workout_history")) #Redirects the user to a particular page
@@ -197,9 +361,15 @@ def edit_calories(entry_id): #The function that runs when someone visits the url
         return "Unauthorised user", 403 #403 Error indicates that the user is unauthorised from accessing the information
     if request.method == "GET": #What happens when it's a GET request
         return render_template("edit_calories.html", entry = entry) # Returns the page, displaying it to the user. The template can loop, showcasing each piece of data
-     #Requests the following values to send to the server from the database
-    entry.meal = request.form.get("meal") 
-    entry.calories = float(request.form.get("calories"))
+    values, error = validate_calories(request.form) #Requests the meal and calories sent from the website and checks them before the totals are touched
+    if error: #Stops empty / wrong submissions to prevent incomplete / incorrect database records. Also returns HTTP 400 (Bad Request)
+        return error, 400
+    touch_user(db.session, entry.user_id) #The user's pages get a new ETag. Done first so the timezone below is read inside the write transaction
+    timezone_name = stored_timezone(db.session, entry.user_id)
+    remove_entry(db.session, entry.user_id, timezone_name, entry.entry_date, entry.calories) #Takes the old calories away from the daily and weekly totals
+    entry.meal = values["meal"]
+    entry.calories = values["calories"]
+    add_entry(db.session, entry.user_id, timezone_name, entry.entry_date, entry.calories) #Adds the new calories to the totals
     #Saves the information to the respective table
     db.session.commit()
     flash("Calories Updated") #Showcases a message to the user
@@ -214,11 +384,32 @@ def delete_calories(entry_id): #The function that runs when someone visits the u
     if entry.user_id != session ["user_id"]: #Confirms that the object belongs to the user
         return "Unauthorised user", 403 #403 Error indicates that the user is unauthorised from accessing the information
     #Deletes the information from the respective table and saves the new one
+    touch_user(db.session, entry.user_id) #The user's pages get a new ETag. Done first so the timezone below is read inside the write transaction
+    remove_entry(db.session, entry.user_id, stored_timezone(db.session, entry.user_id), entry.entry_date, entry.calories) #Takes the meal away from the daily and weekly totals
     db.session.delete(entry)
     db.session.commit()
     flash("Calories Deleted") #Showcases a message to the user
     return redirect(url_for("calorie_history")) #Redirects the user to a particular page
 
+#Allows users to change the timezone their calorie days are counted in
+@app.route("/settings/timezone", methods = ["POST"]) #Tells flask to run the function below this decorator when someone visits the url. The route can respond to POST requests (occurs when the user submits a form)
+def set_timezone(): #The function that runs when someone visits the url
+    if "user_id" not in session: #Redirects the user to the home page if their details are not found in the database
+        return redirect(url_for("home")) #Redirects the user to a particular page
+    timezone_name = request.form.get("timezone", "").strip()
+    if not is_valid_timezone(timezone_name): #Only real timezone names such as Europe/London are accepted. Returns HTTP 400 (Bad Request)
+        return "Unknown timezone", 400
+    user = db.session.get(User, session["user_id"])
+    if user.timezone != timezone_name:
+        user.timezone = timezone_name
+        db.session.flush()
+        rebuild_rollups(db.session, user_id = user.id) #Meals can fall on different days in the new timezone, so the user's totals are worked out again
+        touch_user(db.session, user.id) #Calorie times are shown in the new timezone, so the user's pages get a new ETag
+        db.session.commit()
+    session["timezone"] = timezone_name
+    flash("Timezone updated") #Showcases a message to the user
+    return redirect(url_for("calorie_history")) #Redirects the user to a particular page
+
 #Allows trainers to add an exercise which people can view
 @app.route("/add-exercise", methods = ["GET", "POST"]) #Tells flask to run the function below this decorator when someone visits the url. The route can respond to both GET requests (occurs when the user loads the page) and POST requests (occurs when the user submits a form).
 def add_exercise(): #The function that runs when someone visits the url
@@ -235,57 +426,83 @@ def add_exercise(): #The function that runs when someone visits the url
         #Saves the information to the respective table
         exercise = Exercise(name = name, description = description, muscle_group = muscle_group,  difficulty = difficulty, image_url = image_url, trainer_id = session["user_id"])
         db.session.add(exercise)
+        exercise_added(db.session, exercise.trainer_id) #Adds one to the trainer's exercise count in the same transaction
         db.session.commit()
+        catalogue_cache.invalidate() #The catalogue has changed, so every worker has to reload it
         flash("Exercise added successfully! ") #Showcases a message to the user
         return redirect(url_for("personal_trainer_dashboard")) #Redirects the user to a particular page
     return render_template("add_exercise.html") # Returns the page, displaying it to the user.
 
 #The page where users can view the exercises
 @app.route("/exercises") #Tells flask to run the function below this decorator when someone visits the url.
+@conditional(catalogue_version, all_ratings_stamp) #Answers 304 Not Modified if neither the catalogue nor any exercise's rating has changed since the user's last visit
 def exercises():  #The function that runs when someone visits the url
-    exercises = Exercise.query.all() #Retrieves every record from the table
-    return render_template("exercises.html", exercises = exercises) # Returns the page, displaying it to the user. The template can loop, showcasing each piece of data
+    query = request.args.get("q", "").strip() #What the user searched for
+    filters = {column: request.args.get(column) for column in FACETS if request.args.get(column)} #The muscle group / difficulty the user filtered by
+    if not query and not filters: #The full catalogue comes from the catalogue cache
+        return render_template("exercises.html", grid = exercise_grid(), search = None) # Returns the page, displaying it to the user.
+    search = search_exercises(query, filters, limit = MAX_PAGE_SIZE)
+    grid = Markup(render_template("exercise_grid.html", exercises = search["results"]))
+    return render_template("exercises.html", grid = grid, search = search) # Returns the page with only the matching exercises and the counts for each filter
+
+#Searches the exercise catalogue and returns the ranked matches and the counts for each filter as JSON
+@app.route("/exercises/search") #Tells flask to run the function below this decorator when someone visits the url.
+@conditional(catalogue_version, all_ratings_stamp) #Answers 304 Not Modified if neither the catalogue nor the ratings have changed since the same search was last made
+def exercise_search(): #The function that runs when someone visits the url
+    query = request.args.get("q", "").strip()
+    filters = {column: request.args.get(column) for column in FACETS if request.args.get(column)}
+    limit = min(max(request.args.get("limit", DEFAULT_PAGE_SIZE, type = int), 1), MAX_PAGE_SIZE) #Keeps the number of results between 1 and MAX_PAGE_SIZE
+    offset = max(request.args.get("offset", 0, type = int), 0)
+    return jsonify(search_exercises(query, filters, limit = limit, offset = offset))
 
 #Users can click on the exercise to view details about it.
 @app.route("/exercise/<int:exercise_id>") #Tells flask to run the function below this decorator when someone visits the url. This is a dynamic route based on the id of the object
+@conditional(catalogue_version, rating_stamp, user_stamp, similarity_stamp) #The exercise comes from the catalogue, the reviews and rating change with each review, the favourite button depends on the user, and "also liked" changes when other users' likes do
 def exercise_detail(exercise_id):  #The function that runs when someone visits the url. The parameter informs which object the user wants to view
-    exercise = Exercise.query.get_or_404(exercise_id) #Searches the table and returns a 404 error (the object doesn't exist) if nothing is found
-    is_favourite = False
-    reviews = Review_Exercise.query.filter_by(exercise_id = exercise.id).all()
-    if "user_id" in session:
-        is_favourite = Favourite_Exercise.query.filter_by(user_id = session["user_id"], exercise_id = exercise.id).first() is not None
-    return render_template("exercise_detail.html", exercise = exercise, is_favourite = is_favourite, reviews = reviews) # Returns the page, displaying it to the user. The template can loop, showcasing each piece of data
+    exercise = load_exercise(exercise_id) #Looks the exercise up in the catalogue cache, falling back to the table
+    if exercise is None: #Returns a 404 error (the object doesn't exist) if nothing is found
+        abort(404)
+    reviews, next_cursor = review_page(exercise_id)
+    is_favourite = is_favourite_exercise(exercise_id)
+    also_liked = similar_exercises(db.session, exercise_id) #Exercises liked by users who like this one, read from the precomputed similarities
+    return render_template("exercise_detail.html", exercise = exercise, is_favourite = is_favourite, reviews = reviews, next_cursor = next_cursor, also_liked = also_liked) # Returns the page, displaying it to the user. The template can loop, showcasing each piece of data
 
 #A feature that allows user to favourite an exercise and save it
 @app.route("/toggle-favourite/<int:exercise_id>", methods = ["POST"]) #Tells flask to run the function below this decorator when someone visits the url. The route can respond to POST requests (occurs when the user submits a form). This is a dynamic route based on the id of the object  
 def toggle_favourite(exercise_id):  #The function that runs when someone visits the url. The parameter informs which object the user wants to view
     if "user_id" not in session:  #Redirects the user to the home page if their details are not found in the database
         return redirect(url_for("home")) #Redirects the user to a particular page
-    favourite = Favourite_Exercise.query.filter_by(user_id = session["user_id"], exercise_id = exercise_id).first() #Looks for a row in the Favourite table that matches the current user and the exercise they clicked on
-    if favourite: #If the favourite exists it removes it
-        db.session.delete(favourite)
-        db.session.commit()
-        flash("Removed from Favourites")
-    else:  #If the favourite doesn't exist it adds it to the table
-        new_favourite = Favourite_Exercise(user_id = session["user_id"], exercise_id = exercise_id)
-        db.session.add(new_favourite)
+    user_id = session["user_id"]
+    def change(db_session):
+        favourite = db_session.query(Favourite_Exercise).filter_by(user_id = user_id, exercise_id = exercise_id).first() #Looks for a row in the Favourite table that matches the current user and the exercise they clicked on
+        if favourite: #If the favourite exists it removes it
+            db_session.delete(favourite)
+            favourite_changed(db_session, exercise_id, -1) #Updates the trainer's favourite count and top exercises in the same transaction
+            return False
+        db_session.add(Favourite_Exercise(user_id = user_id, exercise_id = exercise_id)) #If the favourite doesn't exist it adds it to the table
+        favourite_changed(db_session, exercise_id, 1)
+        return True
+    if save(lambda db_session: track_likes(db_session, user_id, exercise_id, change), user_id = user_id): #Updates the exercise similarities and the user's suggestions in the same transaction
         flash("Added to favourites")
-        db.session.commit()
+    else:
+        flash("Removed from Favourites")
     return redirect(url_for("exercise_detail", exercise_id = exercise_id)) #redirects the user to the exercise_detail page
 
 #Where the users can view their saved exercises
 @app.route("/view-favourites") #Tells flask to run the function below this decorator when someone visits the url.
+@conditional(catalogue_version, user_stamp) #Answers 304 Not Modified if neither the user's favourites nor the exercises have changed
 def view_favourites():  #The function that runs when someone visits the url.
     if "user_id" not in session: #Redirects the user to the home page if their details are not found in the database
         return redirect(url_for(home)) #Redirects the user to a particular page
-    favourite_exercises = db.session.query(Exercise).join(Favourite_Exercise, Favourite_Exercise.exercise_id == Exercise.id).filter(Favourite_Exercise.user_id == session ["user_id"]) #Selects data from the exercise table and joins it to the favourite_exercise table and filters the data to the ones only the logged-in users can view
-    return render_template("view_favourites.html", exercises = favourite_exercises) # Returns the page, displaying it to the user. The template can loop, showcasing each piece of data
+    return render_template("view_favourites.html", exercises = favourite_exercises(session["user_id"])) # Returns the page, displaying it to the user. The template can loop, showcasing each piece of data
 
 #Allows users to add reviews
 @app.route("/add-review/<int:exercise_id>", methods = ["POST"]) #Tells flask to run the function below this decorator when someone visits the url. The route can respond to POST requests (occurs when the user submits a form). This is a dynamic route based on the id of the object
 def add_review(exercise_id): #The function that runs when someone visits the url.
     if "user_id" not in session: #Redirects the user to the home page if their details are not found in the database
         return redirect(url_for("home")) #Redirects the user to a particular page
+    if load_exercise(exercise_id) is None: #Returns a 404 error if the exercise being reviewed doesn't exist
+        abort(404)
     #Requests the following values to send to the server from the webpage
     rating = float(request.form.get("rating")) 
     comment = request.form.get("comment")
@@ -293,23 +510,233 @@ def add_review(exercise_id): #The function that runs when someone visits the url
     if rating < 1 or rating > 5:
         flash("Rating must be between 1 and 5")
         return redirect(url_for("exercise_detail", exercise_id = exercise_id)) #Redirects the user to a particular page
-    existing_Review = Review_Exercise.query.filter_by(user_id = session["user_id"], exercise_id = exercise_id).first() #Looks for a row in the Review_Exercise table that matches the current user and the review they left
-    if existing_Review: #Doesn't allow users to leave more than 1 review
+    user_id = session["user_id"]
+    def write(db_session):
+        existing_Review = db_session.query(Review_Exercise).filter_by(user_id = user_id, exercise_id = exercise_id).first() #Looks for a row in the Review_Exercise table that matches the current user and the review they left
+        if existing_Review: #Doesn't allow users to leave more than 1 review
+            return False
+        #Saves the information to the respective table
+        review = Review_Exercise(user_id = user_id, exercise_id = exercise_id, rating = rating, comment = comment)
+        db_session.add(review)
+        record_rating(db_session, exercise_id, rating) #Updates the exercise's rating summary in the same transaction as the review
+        review_added(db_session, review) #Updates the trainer's review totals, top exercises and recent reviews. Runs after record_rating, whose summary it reads
+        return True
+    if not save(lambda db_session: track_likes(db_session, user_id, exercise_id, write), user_id = user_id): #A high rating counts as liking the exercise, so the similarities and the user's suggestions are updated too
         flash("You can't leave more than 1 review")
         return redirect(url_for("exercise_detail", exercise_id = exercise_id)) #Redirects the user to a particular page. 
-    #Saves the information to the respective table
-    review = Review_Exercise(user_id = session["user_id"], exercise_id = exercise_id, rating = rating, comment = comment) 
-    db.session.add(review)
-    db.session.commit()
     flash("Review added!") #Showcases a message to the user
     return redirect(url_for("exercise_detail", exercise_id = exercise_id)) #Returns the page, displaying it to the user. The template can loop, showcasing each piece of data
 
+#Lets users import many workouts or calorie entries at once from a CSV or NDJSON file
+@app.route("/import/<kind>", methods = ["POST"]) #Tells flask to run the function below this decorator when someone visits the url. The route can respond to POST requests (occurs when the user submits a form). "kind" is either workouts or calories
+def import_data(kind): #The function that runs when someone visits the url.
+    if "user_id" not in session: #Redirects the user to the home page if their details are not found in the database
+        return redirect(url_for("home")) #Redirects the user to a particular page
+    if kind not in KINDS: #Returns a 404 error if the kind of data doesn't exist
+        abort(404)
+    upload = request.files.get("file")
+    if upload is None:
+        return "Please choose a file to import", 400
+    try:
+        file_format = guess_format(upload.filename, request.form.get("format") or request.args.get("format"))
+    except ValueError as error:
+        return str(error), 400
+    text_stream = io.TextIOWrapper(upload.stream, encoding = "utf-8-sig", newline = "") #Reads the upload as text one line at a time instead of loading it all into memory
+    report = import_records(kind, session["user_id"], text_stream, file_format)
+    return jsonify(report), 200 if report["error_count"] == 0 else 207 #207 (Multi-Status) shows that some rows were rejected; the report lists them
+
+#Lets users download all of their workouts or calorie entries
+@app.route("/export/<kind>") #Tells flask to run the function below this decorator when someone visits the url. "kind" is either workouts or calories
+def export_data(kind): #The function that runs when someone visits the url.
+    if "user_id" not in session: #Redirects the user to the home page if their details are not found in the database
+        return redirect(url_for("home")) #Redirects the user to a particular page
+    if kind not in KINDS: #Returns a 404 error if the kind of data doesn't exist
+        abort(404)
+    try:
+        file_format = guess_format(None, request.args.get("format", "csv"))
+    except ValueError as error:
+        return str(error), 400
+    mimetype = "text/csv" if file_format == "csv" else "application/x-ndjson"
+    rows = export_records(kind, session["user_id"], file_format) #A generator, so rows are sent as they are read instead of being built up in memory
+    return Response(stream_with_context(rows), mimetype = mimetype, headers = {"Content-Disposition": f"attachment; filename={kind}.{file_format}"})
+
+#Receives the workouts and calorie entries the service worker queued while the user was offline, all in one request
+@app.route("/api/sync", methods = ["POST"]) #Tells flask to run the function below this decorator when someone visits the url. The route can respond to POST requests
+def api_sync(): #The function that runs when someone visits the url.
+    if "user_id" not in session: #The queue is kept until the user logs in again. Returns HTTP 401 (Unauthorised)
+        return jsonify({"error": "Not logged in"}), 401
+    payload = request.get_json(silent = True) #The JSON body, or None if it isn't valid JSON
+    if not isinstance(payload, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    if payload.get("user_id") != session["user_id"]: #The entries were made by someone else on this device. Returns HTTP 409 (Conflict) so the service worker keeps them until that user logs in again
+        return jsonify({"error": "These entries belong to a different user"}), 409
+    try:
+        results = sync_entries(session["user_id"], payload.get("entries"))
+    except SyncError as error:
+        return jsonify({"error": str(error)}), 400
+    return jsonify({"results": results}) #One result per entry so the service worker knows which ones it can remove from its queue
+
+#JSON versions of the history, exercise and favourites pages for the app to poll. Like the pages, each answers 304 Not Modified when nothing it shows has changed
+@app.route("/api/workouts") #Tells flask to run the function below this decorator when someone visits the url.
+@conditional(user_stamp)
+def api_workouts(): #The function that runs when someone visits the url.
+    if "user_id" not in session: #Returns HTTP 401 (Unauthorised)
+        return jsonify({"error": "Not logged in"}), 401
+    workouts, next_cursor = keyset_page(Workout.query.filter_by(user_id = session["user_id"]), Workout.workout_date, Workout.id, date.fromisoformat) #The same pages as the workout history, next_cursor is the query string for the next (older) page
+    return jsonify({"workouts": [json_row(workout) for workout in workouts], "next": next_cursor})
+
+@app.route("/api/calories") #Tells flask to run the function below this decorator when someone visits the url.
+@conditional(user_stamp)
+def api_calories(): #The function that runs when someone visits the url.
+    if "user_id" not in session: #Returns HTTP 401 (Unauthorised)
+        return jsonify({"error": "Not logged in"}), 401
+    entries, next_cursor, daily_totals, weekly_totals, timezone_name = calorie_page(session["user_id"])
+    return jsonify({
+        "entries": [{**json_row(entry), "local_time": entry.local_time.isoformat()} for entry in entries],
+        "next": next_cursor,
+        "daily_totals": [json_row(day) for day in daily_totals],
+        "weekly_totals": [json_row(week) for week in weekly_totals],
+        "timezone": timezone_name,
+    })
+
+@app.route("/api/exercises") #Tells flask to run the function below this decorator when someone visits the url.
+@conditional(catalogue_version, all_ratings_stamp)
+def api_exercises(): #The function that runs when someone visits the url.
+    query = request.args.get("q", "").strip()
+    filters = {column: request.args.get(column) for column in FACETS if request.args.get(column)}
+    if not query and not filters: #The full catalogue comes from the catalogue cache
+        return jsonify({"exercises": exercise_list()})
+    return jsonify(search_exercises(query, filters, limit = MAX_PAGE_SIZE)) #The same matches and filter counts as the exercises page
+
+@app.route("/api/exercises/<int:exercise_id>") #Tells flask to run the function below this decorator when someone visits the url. This is a dynamic route based on the id of the object
+@conditional(catalogue_version, rating_stamp, user_stamp, similarity_stamp)
+def api_exercise_detail(exercise_id): #The function that runs when someone visits the url.
+    exercise = load_exercise(exercise_id)
+    if exercise is None: #Returns a 404 error (the object doesn't exist) if nothing is found
+        return jsonify({"error": "Exercise not found"}), 404
+    reviews, next_cursor = review_page(exercise_id)
+    return jsonify({
+        "exercise": exercise,
+        "reviews": [{**json_row(review), "username": review.user.username} for review in reviews],
+        "next": next_cursor,
+        "is_favourite": is_favourite_exercise(exercise_id),
+        "also_liked": [dict(row) for row in similar_exercises(db.session, exercise_id)],
+    })
+
+@app.route("/api/favourites") #Tells flask to run the function below this decorator when someone visits the url.
+@conditional(catalogue_version, user_stamp)
+def api_favourites(): #The function that runs when someone visits the url.
+    if "user_id" not in session: #Returns HTTP 401 (Unauthorised)
+        return jsonify({"error": "Not logged in"}), 401
+    return jsonify({"exercises": [json_row(exercise) for exercise in favourite_exercises(session["user_id"])]})
+
+#Returns the user's training progress as JSON: weekly volume, rolling average volume, estimated one rep max and personal records for each exercise
+@app.route("/progress") #Tells flask to run the function below this decorator when someone visits the url.
+def progress(): #The function that runs when someone visits the url.
+    if "user_id" not in session: #Redirects the user to the home page if their details are not found in the database
+        return redirect(url_for("home")) #Redirects the user to a particular page
+    weeks = min(max(request.args.get("weeks", 12, type = int), 1), 520) #How many recent weeks of volume to return, up to 10 years
+    return jsonify(user_progress(session["user_id"], weeks = weeks))
+
+#Shows how well the catalogue cache is working in this worker
+@app.route("/cache-stats") #Tells flask to run the function below this decorator when someone visits the url.
+def cache_stats(): #The function that runs when someone visits the url.
+    stats = {**catalogue_cache.stats(), "progress": progress_cache.stats()}
+    if group_committer:
+        stats["group_commit"] = group_committer.stats() #How many writes each group transaction saved on average
+    return jsonify(stats) #Returns the hit/miss counters as JSON
+
+#Request latency histograms, SQL time and cache counters for this worker in the Prometheus text format
+@app.route("/metrics") #Tells flask to run the function below this decorator when someone visits the url.
+def metrics_page(): #The function that runs when someone visits the url.
+    stats = {"catalogue_cache": catalogue_cache.stats(), "progress_cache": progress_cache.stats()}
+    if group_committer:
+        stats["group_commit"] = group_committer.stats()
+    if stats_reconciler:
+        stats["trainer_stats_reconcile"] = stats_reconciler.stats()
+    return Response(metrics.render(stats), mimetype = "text/plain; version=0.0.4") #The content type Prometheus expects
+
 #Ends the app if the user chooses to
 @app.route("/logout") #Tells flask to run the function below this decorator when someone visits the url.
 def logout(): #The function that runs when someone visits the url.
     session.clear() #Removes all data stored in the user’s session.
     return redirect(url_for("home")) #Redirects the user to a particular page
 
+#Command line tool that upgrades an existing database. Run with: flask --app App upgrade-db
+@app.cli.command("upgrade-db")
+def upgrade_db_command():
+    version = upgrade_database()
+    print(f"Database is at schema version {version}")
+
+#Command line tool that imports a file for a user. Run with: flask --app App import-data USERNAME workouts history.csv
+@app.cli.command("import-data")
+@click.argument("username")
+@click.argument("kind", type = click.Choice(list(KINDS)))
+@click.argument("path", type = click.Path(exists = True, dir_okay = False))
+@click.option("--format", "file_format", default = None, help = "csv or ndjson. Worked out from the file extension if not given")
+@click.option("--batch-size", default = 1000, show_default = True, help = "How many rows are inserted and committed at a time")
+def import_data_command(username, kind, path, file_format, batch_size):
+    user = User.query.filter_by(username = username).first()
+    if user is None:
+        raise click.ClickException(f"No user called {username}")
+    try:
+        file_format = guess_format(path, file_format)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    with open(path, encoding = "utf-8-sig", newline = "") as text_stream:
+        report = import_records(kind, user.id, text_stream, file_format, batch_size = batch_size)
+    print(f"Imported {report['imported']} rows, rejected {report['error_count']}")
+    for error in report["errors"]:
+        print(f"  line {error['line']}: {error['error']}")
+
+#Command line tool that recalculates the daily and weekly calorie totals. Run with: flask --app App rebuild-rollups
+@app.cli.command("rebuild-rollups")
+@click.option("--username", default = None, help = "Only rebuild this user's totals")
+def rebuild_rollups_command(username):
+    user_id = None
+    if username:
+        user = User.query.filter_by(username = username).first()
+        if user is None:
+            raise click.ClickException(f"No user called {username}")
+        user_id = user.id
+    rebuild_rollups(db.session, user_id = user_id)
+    db.session.commit()
+    print("Calorie totals rebuilt")
+
+#Command line tool that works out every exercise similarity and suggestion again from the favourites and reviews. Run with: flask --app App rebuild-recommendations
+@app.cli.command("rebuild-recommendations")
+def rebuild_recommendations_command():
+    rebuild_recommendations(db.session)
+    db.session.commit()
+    print("Recommendations rebuilt")
+
+#Command line tool that recalculates every trainer's dashboard totals from the tables. Run with: flask --app App reconcile-trainer-stats
+@app.cli.command("reconcile-trainer-stats")
+def reconcile_trainer_stats_command():
+    count = reconcile_in_batches(db.session) #Commits each batch of trainers, so the app keeps saving changes while it runs
+    print(f"Totals recalculated for {count} trainers")
+
+#Command line tool that fills an empty database with made-up data for benchmarks. Run with: FITFRESH_DATABASE_URL=sqlite:///bench.db flask --app App seed-data --users 10000 --workouts 5000000
+@app.cli.command("seed-data")
+@click.option("--users", default = 100, show_default = True, help = "Gym goers to create")
+@click.option("--trainers", default = 10, show_default = True, help = "Personal trainers to create")
+@click.option("--exercises", default = 200, show_default = True, help = "Exercises to create")
+@click.option("--workouts", default = 20000, show_default = True, help = "Workouts to create, spread unevenly between the users")
+@click.option("--calories", default = 20000, show_default = True, help = "Calorie entries to create")
+@click.option("--favourites", default = 1000, show_default = True, help = "Favourites to create")
+@click.option("--reviews", default = 1000, show_default = True, help = "Reviews to create")
+@click.option("--batch-size", default = 10000, show_default = True, help = "Rows inserted and committed at a time")
+@click.option("--random-seed", default = 42, show_default = True, help = "The same seed always creates the same data")
+def seed_data_command(**scale):
+    if scale["users"] < 1 or scale["trainers"] < 1:
+        raise click.ClickException("At least one user and one trainer are needed")
+    upgrade_database()
+    if User.query.first() is not None:
+        raise click.ClickException("The database already has users. Seed an empty database, e.g. by setting FITFRESH_DATABASE_URL")
+    seed(**scale)
+    catalogue_cache.invalidate() #The catalogue has changed, so every worker has to reload it
+    print("Seeding finished")
+
 if __name__ == "__main__": #Ensures the app runs when the file is executed
     #with app.app_context():
         #db.create_all()
@@ -1,5 +1,87 @@
+import os #Allows python to interact with the operating system
+import threading #Provides locks so several request threads can share the pool and the limiter safely
+import time #Used to time login attempts for the rate limiter
+from collections import OrderedDict, deque #deque: A list that is fast to add to and remove from at both ends. OrderedDict: A dictionary that remembers the order keys were used in
+from concurrent.futures import ProcessPoolExecutor #Runs password hashing in separate processes so it doesn't block the threads that render pages
 from werkzeug.security import generate_password_hash, check_password_hash  #Werkzeug allows the hashing of passwords. generate_password_hash creates a hash from a password and check_password_hash checks the password with the hashed versions to verify the account
+
+PASSWORD_HASH_METHOD = "scrypt:32768:8:1" #The hash method and its parameters. Werkzeug writes this at the start of every hash, so changing it makes old hashes get upgraded the next time their user logs in
+_pool = None
+_pool_lock = threading.Lock()
+_max_workers = max((os.cpu_count() or 2) // 2, 1) #By default hashing can use half of the CPU cores, leaving the rest for page rendering
+_slots = threading.BoundedSemaphore(_max_workers * 4) #Limits how many hashes can be waiting for the pool at once
+
+class HashingUnavailable(Exception): #Raised when every hashing slot is busy, so the route can tell the user to try again instead of queueing forever
+    pass
+
+def configure_hashing(max_workers = None, method = None, queue_factor = 4): #Sets how many processes hash passwords at once. Must be called before the first hash
+    global _max_workers, _slots, PASSWORD_HASH_METHOD
+    if max_workers:
+        _max_workers = max(int(max_workers), 1)
+        _slots = threading.BoundedSemaphore(_max_workers * queue_factor)
+    if method:
+        PASSWORD_HASH_METHOD = method
+
+def _get_pool(): #Creates the process pool the first time it's needed
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers = _max_workers)
+        return _pool
+
+def _run(function, *args, timeout = 10): #Runs a hashing function in the pool, waiting at most "timeout" seconds for a free slot
+    if not _slots.acquire(timeout = timeout):
+        raise HashingUnavailable()
+    try:
+        return _get_pool().submit(function, *args).result()
+    finally:
+        _slots.release()
+
 def hash_password(password): #This function generates a password hash from the provided password.
-    return generate_password_hash(password) 
+    return _run(generate_password_hash, password, PASSWORD_HASH_METHOD)
 def verify_password(password, hashed_password): #This function compares the passwords to the hashed versions to verify if they are the same.
-    return check_password_hash(hashed_password, password) 
+    return _run(check_password_hash, hashed_password, password)
+def needs_rehash(hashed_password): #Checks whether a hash was made with different settings from PASSWORD_HASH_METHOD
+    return hashed_password.split("$", 1)[0] != PASSWORD_HASH_METHOD
+
+class LoginRateLimiter: #Counts failed logins per username and per IP address within a time window. Checking it costs a dictionary lookup, so floods are turned away before any password is hashed
+    def __init__(self, max_per_username = 5, max_per_ip = 50, window_seconds = 300, max_keys = 100000):
+        self.max_per_username = max_per_username #Failed attempts allowed for one username within the window
+        self.max_per_ip = max_per_ip #Failed attempts allowed from one IP address within the window
+        self.window_seconds = window_seconds #How long a failed attempt is remembered for
+        self.max_keys = max_keys #The most usernames/IP addresses remembered, so a flood of random usernames can't use up all the memory
+        self._failures = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _recent(self, key, now): #Returns the failed attempts for a key that are still inside the window. Must be called while holding the lock
+        attempts = self._failures.get(key)
+        if attempts is None:
+            return 0
+        while attempts and attempts[0] <= now - self.window_seconds:
+            attempts.popleft()
+        if not attempts:
+            del self._failures[key]
+            return 0
+        return len(attempts)
+
+    def is_blocked(self, username, ip_address): #True if the username or the IP address has too many recent failed attempts
+        now = time.monotonic()
+        with self._lock:
+            blocked = self._recent(("user", username), now) >= self.max_per_username or self._recent(("ip", ip_address), now) >= self.max_per_ip
+            if blocked:
+                self.rejected += 1
+            return blocked
+
+    def record_failure(self, username, ip_address): #Remembers a failed login for both the username and the IP address
+        now = time.monotonic()
+        with self._lock:
+            for key in (("user", username), ("ip", ip_address)):
+                self._failures.setdefault(key, deque()).append(now)
+                self._failures.move_to_end(key)
+            while len(self._failures) > self.max_keys:
+                self._failures.popitem(last = False) #Forgets the key that failed least recently
+
+    def reset(self, username): #Clears a username's failed attempts after a successful login
+        with self._lock:
+            self._failures.pop(("user", username), None)
@@ -0,0 +1,327 @@
+#Route-level load benchmark for the app. Drives every route in App.py, either in-process through Flask's test client or against a running server, and reports p50/p95/p99 latency, throughput and SQL queries per request as JSON.
+#Seed a separate database first, then run the benchmark against it:
+#    FITFRESH_DATABASE_URL=sqlite:////tmp/bench.db flask --app App seed-data --users 10000 --workouts 5000000
+#    python Benchmark.py --database /tmp/bench.db --requests 500 --concurrency 8 --output run.json
+#    python Benchmark.py --database /tmp/bench.db --compare run.json
+import argparse #Reads the command line options
+import io #Builds the file uploaded by the import benchmark
+import json #Writes the machine-readable report
+import math #Rounds percentile ranks up
+import os #Allows python to interact with the operating system
+import random #Picks users, exercises and form values for each request
+import sqlite3 #Reads ids from the benchmark database without going through the app
+import sys #Used to set the exit code when a comparison finds a regression
+import threading #Runs requests concurrently
+import time #Times each request
+import urllib.parse #Builds form bodies for the server mode
+import urllib.request #Sends requests to a running server
+import uuid #Gives registered users and synced entries unique names/keys
+from http.cookiejar import CookieJar #Keeps each server-mode thread logged in
+
+SEED_PASSWORD = "password" #Matches Seed_Data.SEED_PASSWORD
+SEARCH_TERMS = ["squ", "bench", "dead", "press", "row", "pull", "curl", "leg"]
+
+#Every route that is benchmarked: a name, the HTTP method, a function that builds the path, a function that builds the form/JSON body, the role the user needs, and whether it changes data (only run with --include-writes)
+def route(name, method, path, body = None, role = "gym_goer", writes = False, json_body = False, upload = False):
+    return {"name": name, "method": method, "path": path, "body": body, "role": role, "writes": writes, "json": json_body, "upload": upload}
+
+def workout_form(ctx):
+    return {"exercise": ctx.rng.choice(["Squat", "Bench Press", "Deadlift"]), "sets": str(ctx.rng.randint(1, 5)), "reps": str(ctx.rng.randint(1, 12)), "weight": str(ctx.rng.randrange(5, 200, 5))}
+
+def calorie_form(ctx):
+    return {"meal": ctx.rng.choice(["Breakfast", "Lunch", "Dinner"]), "calories": str(ctx.rng.randrange(50, 1200))}
+
+def import_file(ctx): #A small CSV of 100 workouts
+    lines = ["exercise,sets,reps,weight"] + [f"Squat,{ctx.rng.randint(1, 5)},{ctx.rng.randint(1, 12)},{ctx.rng.randrange(5, 200, 5)}" for _ in range(100)]
+    return {"file": ("bench.csv", "\n".join(lines).encode())}
+
+def sync_body(ctx): #A sync of 20 queued entries
+    return {"user_id": ctx.user_id, "entries": [{"key": uuid.uuid4().hex, "kind": "workout", "data": workout_form(ctx)} for _ in range(20)]}
+
+ROUTES = [
+    route("home", "GET", lambda ctx: "/", role = None),
+    route("service_worker", "GET", lambda ctx: "/service_worker.js", role = None),
+    route("manifest", "GET", lambda ctx: "/manifest.json", role = None),
+    route("register_page", "GET", lambda ctx: "/register", role = None),
+    route("register_page:post", "POST", lambda ctx: "/register", lambda ctx: {"username": f"bench-{uuid.uuid4().hex[:20]}", "password": SEED_PASSWORD, "role": "gym_goer"}, role = None, writes = True),
+    route("login", "GET", lambda ctx: "/login", role = None),
+    route("login:post", "POST", lambda ctx: "/login", lambda ctx: {"username": ctx.username, "password": SEED_PASSWORD}),
+    route("gym_goer_dashboard", "GET", lambda ctx: "/gym-goer-dashboard"),
+    route("personal_trainer_dashboard", "GET", lambda ctx: "/personal-trainer-dashboard", role = "trainer"),
+    route("log_workout", "GET", lambda ctx: "/log-workout"),
+    route("log_workout:post", "POST", lambda ctx: "/log-workout", workout_form, writes = True),
+    route("workout_history", "GET", lambda ctx: "/workout-history"),
+    route("log_calories", "GET", lambda ctx: "/log-calories"),
+    route("log_calories:post", "POST", lambda ctx: "/log-calories", calorie_form, writes = True),
+    route("calorie_history", "GET", lambda ctx: "/calorie-history"),
+    route("edit_workout", "GET", lambda ctx: f"/edit-workout/{ctx.own('workout')}"),
+    route("edit_workout:post", "POST", lambda ctx: f"/edit-workout/{ctx.own('workout')}", workout_form, writes = True),
+    route("delete_workout", "POST", lambda ctx: f"/delete-workout/{ctx.own('workout', consume = True)}", writes = True),
+    route("edit_calories", "GET", lambda ctx: f"/edit-calories/{ctx.own('calorie_entry')}"),
+    route("edit_calories:post", "POST", lambda ctx: f"/edit-calories/{ctx.own('calorie_entry')}", calorie_form, writes = True),
+    route("delete_calories", "POST", lambda ctx: f"/delete-calories/{ctx.own('calorie_entry', consume = True)}", writes = True),
+    route("set_timezone", "POST", lambda ctx: "/settings/timezone", lambda ctx: {"timezone": ctx.rng.choice(["Australia/Sydney", "Europe/London"])}, writes = True),
+    route("add_exercise", "GET", lambda ctx: "/add-exercise", role = "trainer"),
+    route("add_exercise:post", "POST", lambda ctx: "/add-exercise", lambda ctx: {"name": f"Bench Exercise {uuid.uuid4().hex[:8]}", "description": "Benchmark", "muscle_group": "Legs", "difficulty": "Beginner"}, role = "trainer", writes = True),
+    route("exercises", "GET", lambda ctx: "/exercises"),
+    route("exercises:search", "GET", lambda ctx: f"/exercises?q={ctx.rng.choice(SEARCH_TERMS)}"),
+    route("exercise_search", "GET", lambda ctx: f"/exercises/search?q={ctx.rng.choice(SEARCH_TERMS)}"),
+    route("exercise_detail", "GET", lambda ctx: f"/exercise/{ctx.exercise_id()}"),
+    route("toggle_favourite", "POST", lambda ctx: f"/toggle-favourite/{ctx.exercise_id()}", writes = True),
+    route("view_favourites", "GET", lambda ctx: "/view-favourites"),
+    route("add_review", "POST", lambda ctx: f"/add-review/{ctx.exercise_id()}", lambda ctx: {"rating": str(ctx.rng.randint(1, 5)), "comment": "Benchmark review"}, writes = True),
+    route("import_data", "POST", lambda ctx: "/import/workouts", import_file, writes = True, upload = True),
+    route("export_data", "GET", lambda ctx: "/export/workouts?format=csv"),
+    route("api_sync", "POST", lambda ctx: "/api/sync", sync_body, writes = True, json_body = True),
+    route("api_workouts", "GET", lambda ctx: "/api/workouts"),
+    route("api_calories", "GET", lambda ctx: "/api/calories"),
+    route("api_exercises", "GET", lambda ctx: "/api/exercises"),
+    route("api_exercise_detail", "GET", lambda ctx: f"/api/exercises/{ctx.exercise_id()}"),
+    route("api_favourites", "GET", lambda ctx: "/api/favourites"),
+    route("progress", "GET", lambda ctx: "/progress"),
+    route("cache_stats", "GET", lambda ctx: "/cache-stats", role = None),
+    route("metrics_page", "GET", lambda ctx: "/metrics", role = None),
+    route("logout", "GET", lambda ctx: "/logout"),
+]
+
+class Ids: #The ids requests are built from, read straight from the benchmark database
+    def __init__(self, database, sample = 1000, rng = None):
+        rng = rng or random.Random(0)
+        connection = sqlite3.connect(database, check_same_thread = False) #Shared by the benchmark threads, behind self.lock
+        def sample_ids(sql, *params):
+            ids = [row[0] for row in connection.execute(sql, params)]
+            return rng.sample(ids, min(sample, len(ids)))
+        self.gym_goers = sample_ids("SELECT id FROM user WHERE role = 'gym_goer'")
+        self.trainers = sample_ids("SELECT id FROM user WHERE role != 'gym_goer'")
+        self.exercises = sample_ids("SELECT id FROM exercise")
+        self.usernames = dict(connection.execute(f"SELECT id, username FROM user WHERE id IN ({','.join(map(str, self.gym_goers + self.trainers)) or 'NULL'})"))
+        self.connection = connection
+        self.lock = threading.Lock()
+        if not self.gym_goers or not self.trainers or not self.exercises:
+            raise SystemExit("The benchmark database needs gym goers, trainers and exercises. Seed it with: flask --app App seed-data")
+
+    def owned(self, table, user_id, limit = 200): #Some of a user's own workout or calorie ids, for the edit and delete routes
+        with self.lock:
+            return [row[0] for row in self.connection.execute(f"SELECT id FROM {table} WHERE user_id = ? LIMIT ?", (user_id, limit))]
+
+class Context: #What one benchmark thread knows: its user and a random number generator
+    def __init__(self, ids, role, seed):
+        self.ids = ids
+        self.rng = random.Random(seed)
+        users = ids.trainers if role == "trainer" else ids.gym_goers
+        self.user_id = users[seed % len(users)] #Each thread gets a different user, so two threads never delete the same row
+        self.role = role or "gym_goer"
+        self.username = ids.usernames[self.user_id]
+        self._owned = {}
+
+    def exercise_id(self):
+        return self.rng.choice(self.ids.exercises)
+
+    def own(self, table, consume = False): #Picks one of the user's rows. With consume the id is never used again, since a deleted row can't be deleted twice
+        rows = self._owned.setdefault(table, self.ids.owned(table, self.user_id))
+        if not rows:
+            raise LookupError(f"User {self.user_id} has no {table} rows left")
+        return rows.pop() if consume else self.rng.choice(rows)
+
+class TestClientDriver: #Sends requests through Flask's test client in this process, and counts the SQL statements each request runs
+    def __init__(self, database):
+        os.environ["FITFRESH_DATABASE_URL"] = "sqlite:///" + os.path.abspath(database) #Must be set before App is imported
+        from sqlalchemy import event
+        from App import app, db
+        self.app = app
+        self.local = threading.local()
+        with app.app_context():
+            event.listen(db.engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args): #Runs before every SQL statement
+        self.local.queries = getattr(self.local, "queries", 0) + 1
+
+    def endpoints(self):
+        return {rule.endpoint for rule in self.app.url_map.iter_rules() if rule.endpoint != "static"}
+
+    def client(self, ctx):
+        return self.app.test_client()
+
+    def request(self, client, ctx, spec, path, body):
+        with client.session_transaction() as session: #Logs the user in directly, outside the timed part, so every request (even after /logout) runs as that user
+            session["user_id"] = ctx.user_id
+            session["role"] = ctx.role
+        kwargs = {}
+        if spec["json"]:
+            kwargs["json"] = body
+        elif spec["upload"]:
+            kwargs["data"] = {name: (io.BytesIO(content), filename) for name, (filename, content) in body.items()}
+            kwargs["content_type"] = "multipart/form-data"
+        elif body is not None:
+            kwargs["data"] = body
+        self.local.queries = 0
+        start = time.perf_counter()
+        response = client.open(path, method = spec["method"], **kwargs)
+        response.get_data() #Reads the whole body, including streamed responses
+        elapsed = time.perf_counter() - start
+        response.close()
+        return response.status_code, elapsed, self.local.queries
+
+class ServerDriver: #Sends real HTTP requests to a running server. SQL query counts aren't available in this mode
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+    def endpoints(self):
+        return None
+
+    def client(self, ctx):
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()), NoRedirect())
+        self._login(opener, ctx)
+        return opener
+
+    def _login(self, opener, ctx):
+        opener.open(self.url + "/login", urllib.parse.urlencode({"username": ctx.username, "password": SEED_PASSWORD}).encode()).close()
+
+    def request(self, opener, ctx, spec, path, body):
+        headers = {}
+        data = None
+        if spec["json"]:
+            data = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        elif spec["upload"]:
+            boundary = uuid.uuid4().hex
+            parts = [f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"; filename=\"{filename}\"\r\n\r\n".encode() + content + b"\r\n" for name, (filename, content) in body.items()]
+            data = b"".join(parts) + f"--{boundary}--\r\n".encode()
+            headers["Content-Type"] = f"multipart/form-data; boundary={boundary}"
+        elif body is not None:
+            data = urllib.parse.urlencode(body).encode()
+        request = urllib.request.Request(self.url + path, data = data, headers = headers, method = spec["method"])
+        start = time.perf_counter()
+        try:
+            with opener.open(request) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as error:
+            error.read()
+            status = error.code
+        elapsed = time.perf_counter() - start
+        if spec["name"] == "logout": #Logs back in, outside the timed part
+            self._login(opener, ctx)
+        return status, elapsed, None
+
+class NoRedirect(urllib.request.HTTPRedirectHandler): #Redirects are reported as they are, like the test client does, instead of being followed
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+def percentile(sorted_values, fraction): #The nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1)) #The smallest value with at least that fraction of the values at or below it
+    return sorted_values[index]
+
+def run_route(driver, ids, spec, requests, concurrency, seed): #Sends "requests" requests to one route from "concurrency" threads and summarises them
+    latencies = []
+    queries = []
+    statuses = {}
+    errors = []
+    lock = threading.Lock()
+    per_thread = [requests // concurrency + (1 if index < requests % concurrency else 0) for index in range(concurrency)]
+
+    def worker(index, count):
+        ctx = Context(ids, spec["role"], seed + index)
+        client = driver.client(ctx)
+        for _ in range(count):
+            try:
+                path = spec["path"](ctx)
+                body = spec["body"](ctx) if spec["body"] else None
+                status, elapsed, query_count = driver.request(client, ctx, spec, path, body)
+            except Exception as error: #A request that couldn't be built or sent is counted as an error
+                with lock:
+                    errors.append(f"{type(error).__name__}: {error}")
+                continue
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+                if query_count is not None:
+                    queries.append(query_count)
+
+    threads = [threading.Thread(target = worker, args = (index, count)) for index, count in enumerate(per_thread) if count]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - start
+    latencies.sort()
+    to_ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        "method": spec["method"],
+        "requests": len(latencies),
+        "errors": len(errors) + sum(count for status, count in statuses.items() if status >= 500),
+        "error_samples": errors[:5],
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "p50_ms": to_ms(percentile(latencies, 0.50)),
+        "p95_ms": to_ms(percentile(latencies, 0.95)),
+        "p99_ms": to_ms(percentile(latencies, 0.99)),
+        "mean_ms": to_ms(sum(latencies) / len(latencies)) if latencies else None,
+        "max_ms": to_ms(latencies[-1]) if latencies else None,
+        "throughput_rps": round(len(latencies) / wall_time, 2) if wall_time else None,
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+        "max_queries": max(queries) if queries else None,
+    }
+
+def compare(current, baseline, max_regression): #Prints how each route's p95 changed against an earlier run. Returns the routes that got slower by more than max_regression (0.25 = 25%)
+    regressions = []
+    print(f"\n{'route':32} {'base p95':>10} {'now p95':>10} {'change':>8} {'queries':>12}")
+    for name, result in current["routes"].items():
+        before = baseline.get("routes", {}).get(name)
+        if not before or not before.get("p95_ms") or result["p95_ms"] is None:
+            continue
+        change = result["p95_ms"] / before["p95_ms"] - 1
+        query_change = f"{before.get('queries_per_request')}->{result.get('queries_per_request')}"
+        flag = " <-- regression" if change > max_regression or (result.get("queries_per_request") or 0) > (before.get("queries_per_request") or 0) else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:32} {before['p95_ms']:>10} {result['p95_ms']:>10} {change:>+8.1%} {query_change:>12}{flag}")
+    return regressions
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Benchmark every route in App.py")
+    parser.add_argument("--database", required = True, help = "The seeded SQLite database file to benchmark")
+    parser.add_argument("--url", help = "Benchmark a running server at this URL instead of using the in-process test client")
+    parser.add_argument("--requests", type = int, default = 200, help = "Requests sent to each route")
+    parser.add_argument("--concurrency", type = int, default = 4, help = "Threads sending requests at the same time")
+    parser.add_argument("--routes", help = "Comma separated route names to run (default: all)")
+    parser.add_argument("--include-writes", action = "store_true", help = "Also run routes that change data")
+    parser.add_argument("--seed", type = int, default = 1, help = "Random seed for picking users and values")
+    parser.add_argument("--output", help = "Write the JSON report to this file (default: print it)")
+    parser.add_argument("--compare", help = "An earlier JSON report to compare p95 latency and query counts against")
+    parser.add_argument("--max-regression", type = float, default = 0.25, help = "Allowed p95 slowdown before --compare fails, as a fraction")
+    args = parser.parse_args(argv)
+
+    driver = ServerDriver(args.url) if args.url else TestClientDriver(args.database)
+    ids = Ids(args.database)
+    wanted = set(args.routes.split(",")) if args.routes else None
+    specs = [spec for spec in ROUTES if (wanted is None or spec["name"] in wanted) and (args.include_writes or not spec["writes"] or (wanted and spec["name"] in wanted))]
+    report = {
+        "meta": {"mode": "server" if args.url else "test_client", "database": os.path.abspath(args.database), "requests": args.requests, "concurrency": args.concurrency, "include_writes": args.include_writes, "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z")},
+        "routes": {},
+    }
+    endpoints = driver.endpoints()
+    if endpoints is not None: #Lists any route in App.py the benchmark doesn't know about yet, so new routes aren't silently left out
+        report["meta"]["uncovered_endpoints"] = sorted(endpoints - {spec["name"].split(":")[0] for spec in ROUTES})
+    for spec in specs:
+        result = run_route(driver, ids, spec, args.requests, args.concurrency, args.seed)
+        report["routes"][spec["name"]] = result
+        print(f"{spec['name']:32} p50 {result['p50_ms']} ms  p95 {result['p95_ms']} ms  p99 {result['p99_ms']} ms  {result['throughput_rps']} req/s  {result['queries_per_request']} queries  {result['errors']} errors", file = sys.stderr)
+    output = json.dumps(report, indent = 2)
+    if args.output:
+        with open(args.output, "w") as report_file:
+            report_file.write(output)
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.max_regression)
+        if regressions:
+            print(f"\nRegressions: {', '.join(regressions)}", file = sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+import csv #Reads and writes comma separated values files
+import io #Provides in-memory text buffers used to build each CSV line
+import json #Reads and writes newline delimited JSON (one JSON object per line)
+from datetime import date, datetime #Used to read the optional date of each imported workout, and to write dates in the export
+from sqlalchemy import insert, select #insert: Builds one INSERT statement that is run for a whole batch of rows (executemany). select: Builds the query used by the export
+from DB_Models import db, User, Workout, CalorieEntry #The tables that can be imported and exported
+from Rollups import apply_entries, parse_utc_time #apply_entries: Keeps the daily and weekly calorie totals up to date. parse_utc_time: Reads a meal's time, converting any timezone offset to UTC like the database stores
+from Validation import validate_workout, validate_calories #The same checks the log-workout and log-calories forms use
+from Conditional import touch_user #Gives the user's pages a new ETag, and their training progress a new cache key, when rows are imported
+
+#Describes each kind of data that can be imported/exported: the table, the checks for a row, the date column and how to read it, and the columns written by the export
+KINDS = {
+    "workouts": {"model": Workout, "validate": validate_workout, "date_column": "workout_date", "parse_date": date.fromisoformat, "columns": ["id", "workout_date", "exercise", "sets", "reps", "weight"]},
+    "calories": {"model": CalorieEntry, "validate": validate_calories, "date_column": "entry_date", "parse_date": parse_utc_time, "columns": ["id", "entry_date", "meal", "calories"]},
+}
+FORMATS = ("csv", "ndjson") #The file formats that are supported
+MAX_REPORTED_ERRORS = 100 #The most row errors listed in an import report. Every error is still counted
+
+def guess_format(filename, requested = None): #Works out the file format from the "format" option, or from the file's extension
+    file_format = requested or (filename.rsplit(".", 1)[-1] if filename and "." in filename else "")
+    file_format = file_format.lower()
+    if file_format in ("json", "jsonl"):
+        file_format = "ndjson"
+    if file_format not in FORMATS:
+        raise ValueError(f"Unsupported format, use one of: {', '.join(FORMATS)}")
+    return file_format
+
+NOT_TEXT = "The file isn't UTF-8 text, so nothing from this line on was read" #Reported once, and reading stops, when the upload can't be decoded. The decoder can't pick up again in the middle of a file
+
+def iter_records(text_stream, file_format): #Reads the file one row at a time so large uploads never have to fit in memory. Yields (line number, row dictionary or None, error message or None)
+    if file_format == "csv":
+        reader = csv.DictReader(text_stream)
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as error: #E.g. a NUL byte or an overlong field. The reader carries on from the next line
+                yield reader.line_num, None, f"Invalid CSV: {error}"
+                continue
+            except UnicodeDecodeError:
+                yield reader.line_num + 1, None, NOT_TEXT
+                return
+            yield reader.line_num, row, None
+    else:
+        lines = enumerate(text_stream, start = 1)
+        line_number = 0
+        while True:
+            try:
+                line_number, line = next(lines)
+            except StopIteration:
+                return
+            except UnicodeDecodeError:
+                yield line_number + 1, None, NOT_TEXT
+                return
+            if not line.strip(): #Skips blank lines
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield line_number, None, "Invalid JSON"
+                continue
+            if not isinstance(row, dict):
+                yield line_number, None, "Each line must be a JSON object"
+                continue
+            yield line_number, row, None
+
+def import_records(kind, user_id, text_stream, file_format, batch_size = 1000): #Checks and saves every row in the file for one user. Rows are inserted batch_size at a time with a single executemany, and each batch is committed on its own
+    settings = KINDS[kind]
+    model = settings["model"]
+    date_column = settings["date_column"]
+    report = {"imported": 0, "error_count": 0, "errors": []}
+    batch = []
+    timezone_name = db.session.get(User, user_id).timezone if model is CalorieEntry else None #Calorie totals are counted in the user's own timezone
+
+    def flush(): #Saves the rows waiting in the batch
+        if batch:
+            db.session.execute(insert(model), batch) #One statement run for every row in the batch
+            if model is CalorieEntry: #Adds the whole batch to the daily and weekly totals in the same transaction
+                apply_entries(db.session, user_id, timezone_name, [(values["entry_date"], values["calories"]) for values in batch])
+            touch_user(db.session, user_id)
+            db.session.commit()
+            report["imported"] += len(batch)
+            batch.clear()
+
+    def reject(line_number, error): #Records a row that couldn't be imported
+        report["error_count"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"line": line_number, "error": error})
+
+    for line_number, row, error in iter_records(text_stream, file_format):
+        if error:
+            reject(line_number, error)
+            continue
+        values, error = settings["validate"](row) #The same checks as the form
+        if error:
+            reject(line_number, error)
+            continue
+        raw_date = row.get(date_column)
+        if raw_date: #The date is optional. Rows without one are dated now, like the form
+            try:
+                values[date_column] = settings["parse_date"](str(raw_date))
+            except ValueError:
+                reject(line_number, f"{date_column} must be an ISO date")
+                continue
+        else:
+            values[date_column] = model.__table__.c[date_column].default.arg(None) #Uses the column's own default (today / now)
+        values["user_id"] = user_id
+        batch.append(values)
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    return report
+
+def export_records(kind, user_id, file_format, batch_size = 1000): #A generator that yields the user's rows as CSV or NDJSON text. Rows are fetched batch_size at a time, so memory use stays the same however many rows there are
+    settings = KINDS[kind]
+    model = settings["model"]
+    columns = [model.__table__.c[name] for name in settings["columns"]]
+    date_column = model.__table__.c[settings["date_column"]]
+    statement = select(*columns).where(model.user_id == user_id).order_by(date_column, model.id).execution_options(yield_per = batch_size) #Oldest first, read in the order of the (user_id, date) index. yield_per streams the results instead of loading them all
+    if file_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(settings["columns"])
+    for row in db.session.execute(statement):
+        values = {name: value.isoformat() if isinstance(value, (date, datetime)) else value for name, value in row._mapping.items()}
+        if file_format == "csv":
+            writer.writerow(values.values())
+            yield buffer.getvalue() #The first chunk also includes the header line
+            buffer.seek(0)
+            buffer.truncate()
+        else:
+            yield json.dumps(values) + "\n"
+    if file_format == "csv" and buffer.tell(): #A user with no rows still gets the header line
+        yield buffer.getvalue()
@@ -0,0 +1,91 @@
+import os #Allows python to interact with the operating system
+import threading #Provides a lock so several request threads can share the cache safely
+import time #Used to build version numbers that are unique across worker processes
+from collections import OrderedDict #A dictionary that remembers the order items were used in, which is what an LRU (least recently used) cache needs
+
+class CatalogueCache: #An in-process cache for the exercise catalogue. Each worker process holds its own copy, and a shared version file tells every worker when its copy is out of date
+    def __init__(self, version_path, max_entries = 512):
+        self.version_path = version_path #File that stores the catalogue version shared by every worker process
+        self.max_entries = max_entries #The most items the cache holds before the least recently used one is evicted
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None #The catalogue version the cached items were loaded under
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def read_version(self): #Reads the shared version number. A missing or unreadable file counts as version 0
+        try:
+            with open(self.version_path) as version_file:
+                return int(version_file.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _check_version(self): #Empties this worker's cache if another worker has changed the catalogue since it was filled. Must be called while holding the lock
+        version = self.read_version()
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def _lookup(self, key): #Returns (cached value or None, the catalogue version it was looked up under)
+        with self._lock:
+            self._check_version()
+            if key in self._entries:
+                self._entries.move_to_end(key) #Marks the item as the most recently used
+                self.hits += 1
+                return self._entries[key], self._version
+            self.misses += 1
+            return None, self._version
+
+    def get(self, key): #Returns the cached value for a key, or None if it isn't cached
+        return self._lookup(key)[0]
+
+    def set(self, key, value, version = None): #Stores a value, evicting the least recently used items if the cache is full. version is the catalogue version the value was loaded under; if the catalogue has changed since, the value may be out of date and isn't stored
+        with self._lock:
+            self._check_version()
+            if version is not None and version != self._version:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False) #Removes the oldest item
+                self.evictions += 1
+
+    def get_or_load(self, key, loader): #Returns the cached value, or calls loader() to build it on a miss. None is never cached so a missing exercise doesn't take up space
+        value, version = self._lookup(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.set(key, value, version) #Skipped if any worker invalidated the catalogue while loader() was running
+        return value
+
+    def invalidate(self): #Called after the catalogue changes in the database. Clears this worker's cache and bumps the shared version so the other workers clear theirs on their next request
+        with self._lock:
+            version = max(self.read_version() + 1, time.time_ns()) #Based on the clock so two workers invalidating at the same time can't write the same version
+            directory = os.path.dirname(self.version_path)
+            os.makedirs(directory, exist_ok = True)
+            temporary_path = f"{self.version_path}.{os.getpid()}.tmp"
+            with open(temporary_path, "w") as version_file:
+                version_file.write(str(version))
+            os.replace(temporary_path, self.version_path) #Replaces the file in one step so other workers never read a half-written version
+            self._entries.clear()
+            self._version = version
+            self.invalidations += 1
+
+    def stats(self): #The cache counters, used by the /cache-stats route
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "version": self._version,
+            }
+
+def row_to_dict(row): #Copies a database row into a plain dictionary so it can be cached without keeping the database session alive
+    return {column.key: getattr(row, column.key) for column in row.__table__.columns}
@@ -0,0 +1,66 @@
+import hashlib #Builds the ETag from the version stamps
+from datetime import datetime, timezone #Turns version stamps into Last-Modified times
+from functools import wraps #Keeps the view's name when it's wrapped, which Flask uses as the endpoint
+from flask import request, session, make_response #request: The request being answered. session: The logged-in user. make_response: Turns what a view returns into a response object
+from sqlalchemy import update, func #update: Builds the UPDATE that bumps a user's version. func: Adds up the rating summaries for the catalogue-wide rating stamp
+from werkzeug.http import is_resource_modified #Compares If-None-Match / If-Modified-Since with the current ETag and Last-Modified
+from DB_Models import db, User, ExerciseSimilarityVersion, ExerciseRatingSummary #The user table holds each user's version stamp, each exercise has one for its "also liked" list, and the rating summaries say when each exercise was last reviewed
+
+def touch_user(db_session, user_id): #Bumps a user's version stamp. Call it in the same transaction as any change to the user's workouts, meals, favourites or settings, so their pages get a new ETag
+    db_session.execute(update(User).where(User.id == user_id).values(data_version = User.data_version + 1, data_updated_at = datetime.utcnow()))
+
+def user_stamp(): #The logged-in user's (version, last changed), read with one primary key lookup. None when nobody is logged in
+    if "user_id" not in session:
+        return None
+    row = db.session.query(User.data_version, User.data_updated_at).filter(User.id == session["user_id"]).first()
+    if row is None:
+        return None
+    return row.data_version, row.data_updated_at.replace(tzinfo = timezone.utc) if row.data_updated_at else None #Times are stored in UTC without a timezone
+
+def similarity_stamp(): #The (version, last changed) of the "also liked" list of the exercise in the URL, read with one primary key lookup. None if it has never had any similarities
+    row = db.session.query(ExerciseSimilarityVersion.version, ExerciseSimilarityVersion.updated_at).filter(ExerciseSimilarityVersion.exercise_id == request.view_args["exercise_id"]).first()
+    if row is None:
+        return None
+    return row.version, row.updated_at.replace(tzinfo = timezone.utc) if row.updated_at else None #Times are stored in UTC without a timezone
+
+def rating_stamp(): #The (review count, last reviewed) of the exercise in the URL, read with one primary key lookup. Reviews are never removed, so the count goes up on every new review. None if it has never been reviewed
+    row = db.session.query(ExerciseRatingSummary.review_count, ExerciseRatingSummary.updated_at).filter(ExerciseRatingSummary.exercise_id == request.view_args["exercise_id"]).first()
+    if row is None:
+        return None
+    return row.review_count, row.updated_at.replace(tzinfo = timezone.utc) if row.updated_at else None #Times are stored in UTC without a timezone
+
+def all_ratings_stamp(): #The (total reviews, last reviewed) over every exercise, for pages that list the ratings of the whole catalogue. Read from the summary table, which has one small row per reviewed exercise
+    total, updated_at = db.session.query(func.coalesce(func.sum(ExerciseRatingSummary.review_count), 0), func.max(ExerciseRatingSummary.updated_at)).one()
+    return total, updated_at.replace(tzinfo = timezone.utc) if updated_at else None #Times are stored in UTC without a timezone
+
+def catalogue_stamp(cache): #Returns a function giving the catalogue's (version, last changed) from the shared version file, without touching the database
+    def stamp():
+        version = cache.read_version()
+        return version, datetime.fromtimestamp(version / 1e9, timezone.utc) if version else None #Versions are written from time.time_ns(), so they double as the time of the last change
+    return stamp
+
+def conditional(*stamps): #A decorator for GET views whose output only depends on the given stamps, the logged-in user and the URL. Answers 304 Not Modified without running the view when the client's copy is still current
+    def decorate(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET" or session.get("_flashes"): #A page showing a flash message is only shown once, so it's never tagged
+                return view(*args, **kwargs)
+            values = [stamp() for stamp in stamps]
+            key = repr((request.endpoint, request.full_path, session.get("user_id"), session.get("role"), [value[0] if value else None for value in values]))
+            etag = hashlib.sha256(key.encode()).hexdigest()[:32] #A strong ETag: it changes whenever anything the response depends on changes
+            changed = [value[1] for value in values if value and value[1]]
+            last_modified = max(changed) if len(changed) == len(stamps) else None #Only sent when every stamp has a time, otherwise an unrelated change could be missed
+            if not is_resource_modified(request.environ, etag = etag, last_modified = last_modified):
+                response = make_response("", 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200: #Redirects and errors aren't tagged
+                    return response
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified
+            response.headers["Cache-Control"] = "private, no-cache" #Browsers may keep the page but must check it's still current before using it
+            response.vary.add("Cookie") #The page depends on who is logged in
+            return response
+        return wrapper
+    return decorate
@@ -0,0 +1,41 @@
+from sqlalchemy import event #Lets code run whenever the database engine opens a new connection
+
+#Settings for each way the app can be run. "development" keeps SQLite's defaults. "production" switches to WAL mode so readers never block the writer, and tunes SQLite for many requests at once
+PROFILES = {
+    "development": {
+        "pragmas": {},
+        "engine_options": {},
+    },
+    "production": {
+        "pragmas": {
+            "journal_mode": "WAL", #Write-ahead logging: readers keep reading while a write is committed, instead of the whole database being locked
+            "synchronous": "NORMAL", #In WAL mode this is still safe from corruption, and commits no longer wait for the disk on every write
+            "busy_timeout": 5000, #Waits up to 5 seconds for another connection's write to finish instead of failing straight away with "database is locked"
+            "mmap_size": 268435456, #Reads up to 256MB of the database through memory mapping, which avoids copying pages
+            "cache_size": -65536, #A 64MB page cache per connection (negative numbers are in KB)
+            "temp_store": "MEMORY", #Keeps temporary tables and sort results in memory
+        },
+        "engine_options": {
+            "pool_size": 10, #Connections kept open and reused between requests
+            "max_overflow": 20, #Extra connections allowed during a burst
+            "pool_timeout": 10, #Seconds a request waits for a free connection
+            "pool_recycle": 3600, #Reopens connections older than an hour
+            "connect_args": {"timeout": 5, "check_same_thread": False}, #The driver's own lock timeout, and allows the pool to hand a connection to a different thread than the one that opened it
+        },
+    },
+}
+
+def engine_options(profile): #The SQLAlchemy engine settings for a profile. Must be put in the app's config before db.init_app is called
+    return dict(PROFILES[profile]["engine_options"])
+
+def install_pragmas(engine, profile): #Runs the profile's PRAGMA statements on every new connection the engine opens
+    pragmas = PROFILES[profile]["pragmas"]
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}") #PRAGMA statements can't use bound parameters. The values come from PROFILES, never from users
+        cursor.close()
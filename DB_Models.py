@@ -7,6 +7,9 @@ class User(db.Model, UserMixin): #This defines a user table. db.Model tells SQLA
     username = db.Column(db.String(50), unique = True, nullable = False) #Stores a login name (50 characters) that has to be unique and is required to exist 
     password_hash = db.Column(db.String(255), nullable = False) #Stores the hashed password (255 characters)
     role = db.Column(db.String(20), nullable = False) #Stores the role of the user (gym goer or personal trainer)
+    timezone = db.Column(db.String(50), default = "Australia/Sydney", server_default = "Australia/Sydney", nullable = False) #The user's timezone, used to work out which local day each meal belongs to
+    data_version = db.Column(db.Integer, default = 0, server_default = "0", nullable = False) #Goes up every time the user's workouts, meals, favourites or settings change. Used to build the ETag of their pages
+    data_updated_at = db.Column(db.DateTime, default = datetime.utcnow) #When data_version last went up (UTC). Sent as the Last-Modified header
 class Workout(db.Model): #This defines a workouts table to log exercises.
     id = db.Column(db.Integer, primary_key = True) #Creates a unique ID integer for each user
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable = False) #Links workout to the logged-in user
@@ -15,12 +18,24 @@ class Workout(db.Model): #This defines a workouts table to log exercises.
     sets = db.Column(db.Integer, nullable = False) #How many sets the user performed
     reps = db.Column(db.Integer, nullable = False) #How many reps of each exercise the user performed
     weight = db.Column(db.Float, nullable = False) #The weight that they exercised with
+    __table_args__ = (db.Index("ix_workout_user_date", "user_id", "workout_date"), ) #Composite index so the workout history of one user can be read newest-first without scanning and sorting the whole table
 class CalorieEntry(db.Model): #A table that stores the calories tracked by the user for each meal.
     id = db.Column(db.Integer, primary_key = True)  #Creates a unique ID integer for each user
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable = False) #Links calories to the logged-in user 
     entry_date = db.Column(db.DateTime, default = datetime.utcnow, nullable = False) #The date and time the user tracked the calories
     meal = db.Column(db.String(50), nullable = False) #Meal
     calories = db.Column(db.Float, nullable = False) #Calories of the meal
+    __table_args__ = (db.Index("ix_calorie_entry_user_date", "user_id", "entry_date"), ) #Composite index so the calorie history of one user can be read newest-first without scanning and sorting the whole table
+class DailyCalorieRollup(db.Model): #A table that stores each user's calorie total and meal count for every day in their own timezone, kept up to date as meals are logged, edited and deleted
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key = True) #The user the totals belong to
+    local_date = db.Column(db.Date, primary_key = True) #The day in the user's timezone
+    total_calories = db.Column(db.Float, default = 0, nullable = False) #The calories eaten that day
+    meal_count = db.Column(db.Integer, default = 0, nullable = False) #How many meals were logged that day
+class WeeklyCalorieRollup(db.Model): #The same totals for every week (starting on Monday) in the user's timezone
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key = True) #The user the totals belong to
+    week_start = db.Column(db.Date, primary_key = True) #The Monday the week starts on, in the user's timezone
+    total_calories = db.Column(db.Float, default = 0, nullable = False) #The calories eaten that week
+    meal_count = db.Column(db.Integer, default = 0, nullable = False) #How many meals were logged that week
 class Exercise(db.Model): #A table that stores the exercise added by the trainer.
     id = db.Column(db.Integer, primary_key = True)  #Creates a unique ID integer for each user
     name = db.Column(db.String(100), nullable = False) #Name of the exercise
@@ -29,11 +44,12 @@ class Exercise(db.Model): #A table that stores the exercise added by the trainer
     difficulty = db.Column(db.String(20), nullable = False) #How difficult it's to perform
     image_url = db.Column(db.String(255)) #The image of the exercise
     trainer_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable = False) #Links Exercise to the logged-in user 
+    __table_args__ = (db.Index("ix_exercise_muscle_group", "muscle_group"), db.Index("ix_exercise_difficulty", "difficulty"), db.Index("ix_exercise_trainer", "trainer_id"), ) #Indexes used to filter and count exercises by muscle group and difficulty, and to add up one trainer's exercises
 class Favourite_Exercise(db.Model): #A table that stores the user's favourite exercises
     id = db.Column(db.Integer, primary_key = True) #Creates a unique ID integer for each user
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable = False) #Links favourite to the logged-in user 
     exercise_id = db.Column(db.Integer, db.ForeignKey("exercise.id"), nullable = False) #Links the exercise to its id
-    __table_args__ = (db.UniqueConstraint("user_id", "exercise_id"), ) #Database blocks duplicate favourites from being added.
+    __table_args__ = (db.UniqueConstraint("user_id", "exercise_id"), db.Index("ix_favourite_exercise_exercise", "exercise_id"), ) #Database blocks duplicate favourites from being added. The index counts the favourites of one exercise without scanning every favourite
 class Review_Exercise(db.Model):
     id = db.Column(db.Integer, primary_key = True) #Creates a unique ID integer for each user
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable = False) #Links review to logged-in user
@@ -42,7 +58,64 @@ class Review_Exercise(db.Model):
     comment = db.Column(db.String(400)) #Stores the comment the user made
     created_at = db.Column(db.DateTime, default = datetime.utcnow) #Stores when the review was created
     user = db.relationship("User", backref="exercise_reviews") #Creates an object-level relationship between the user and review_exercise table. Backref creates the reverse relationship while enabling the tables to be claled on later.
-    __table_args__ = (db.UniqueConstraint("user_id", "exercise_id"), ) #Database blocks duplicate favourites from being added.
+    __table_args__ = (db.UniqueConstraint("user_id", "exercise_id"), db.Index("ix_review_exercise_exercise", "exercise_id"), ) #Database blocks duplicate favourites from being added. The index finds the reviews of one exercise without scanning every review
+class ExerciseRatingSummary(db.Model): #A table that stores a running total of the ratings of each exercise so averages don't have to be calculated from every review on each request
+    exercise_id = db.Column(db.Integer, db.ForeignKey("exercise.id"), primary_key = True) #One summary row per exercise
+    review_count = db.Column(db.Integer, default = 0, nullable = False) #How many reviews the exercise has
+    rating_sum = db.Column(db.Integer, default = 0, nullable = False) #The total of every rating, divided by review_count to give the average
+    star_1 = db.Column(db.Integer, default = 0, nullable = False) #How many 1 star reviews the exercise has
+    star_2 = db.Column(db.Integer, default = 0, nullable = False) #How many 2 star reviews the exercise has
+    star_3 = db.Column(db.Integer, default = 0, nullable = False) #How many 3 star reviews the exercise has
+    star_4 = db.Column(db.Integer, default = 0, nullable = False) #How many 4 star reviews the exercise has
+    star_5 = db.Column(db.Integer, default = 0, nullable = False) #How many 5 star reviews the exercise has
+    updated_at = db.Column(db.DateTime) #When the exercise last got a review, used for Last-Modified on the pages that show ratings
+    @property
+    def average(self): #The average rating, or None if there are no reviews yet
+        return self.rating_sum / self.review_count if self.review_count else None
+    @property
+    def histogram(self): #The number of reviews for each star rating, from 5 stars down to 1
+        return [(stars, getattr(self, f"star_{stars}")) for stars in range(5, 0, -1)]
+class ExerciseLikeCount(db.Model): #A table that stores how many users like each exercise (favourited it or rated it 4 stars or more). Used to score similar exercises and to suggest popular exercises to new users
+    exercise_id = db.Column(db.Integer, db.ForeignKey("exercise.id"), primary_key = True) #One row per liked exercise
+    like_count = db.Column(db.Integer, default = 0, nullable = False) #How many users like the exercise
+    __table_args__ = (db.Index("ix_exercise_like_count_likes", "like_count"), ) #Finds the most liked exercises without sorting the table
+class ExerciseSimilarity(db.Model): #A table that stores, for every pair of exercises liked by the same users, how many users like both and how similar that makes them. Each pair is stored both ways round
+    exercise_id = db.Column(db.Integer, db.ForeignKey("exercise.id"), primary_key = True) #The exercise being looked at
+    similar_id = db.Column(db.Integer, db.ForeignKey("exercise.id"), primary_key = True) #An exercise liked by users who also like exercise_id
+    co_count = db.Column(db.Integer, default = 0, nullable = False) #How many users like both exercises
+    score = db.Column(db.Float, default = 0, nullable = False) #How similar the exercises are, from 0 to 1
+    __table_args__ = (db.Index("ix_exercise_similarity_top", "exercise_id", "score"), ) #Reads the most similar exercises to one exercise straight from the index
+class ExerciseSimilarityVersion(db.Model): #A table that stores a version stamp for each exercise's "also liked" list, bumped in the same transaction as any change to its similarities, so the exercise pages get a new ETag when another user's likes change the list
+    exercise_id = db.Column(db.Integer, db.ForeignKey("exercise.id"), primary_key = True) #One row per exercise whose similarities have ever changed. Rows are never deleted, so a version is never reused
+    version = db.Column(db.Integer, default = 0, nullable = False) #Goes up by one on every change
+    updated_at = db.Column(db.DateTime) #When the list last changed, used for Last-Modified
+class ExerciseRecommendation(db.Model): #A table that stores each user's suggested exercises, worked out when their likes change so the dashboard only has to read them
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key = True) #The user the suggestions are for
+    rank = db.Column(db.Integer, primary_key = True) #1 is the best suggestion
+    exercise_id = db.Column(db.Integer, db.ForeignKey("exercise.id"), nullable = False) #The suggested exercise
+    score = db.Column(db.Float, nullable = False) #How strongly the exercise is suggested
+class TrainerStats(db.Model): #A table that stores one row of totals for each trainer's exercises, kept up to date as exercises, favourites and reviews are added, so the trainer dashboard doesn't have to add them up on every visit
+    trainer_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key = True) #One row per trainer
+    exercise_count = db.Column(db.Integer, default = 0, nullable = False) #How many exercises the trainer has added
+    favourite_count = db.Column(db.Integer, default = 0, nullable = False) #How many times their exercises have been favourited
+    review_count = db.Column(db.Integer, default = 0, nullable = False) #How many reviews their exercises have
+    rating_sum = db.Column(db.Integer, default = 0, nullable = False) #The total of every rating, divided by review_count to give the average
+    star_1 = db.Column(db.Integer, default = 0, nullable = False) #How many 1 star reviews their exercises have
+    star_2 = db.Column(db.Integer, default = 0, nullable = False) #How many 2 star reviews their exercises have
+    star_3 = db.Column(db.Integer, default = 0, nullable = False) #How many 3 star reviews their exercises have
+    star_4 = db.Column(db.Integer, default = 0, nullable = False) #How many 4 star reviews their exercises have
+    star_5 = db.Column(db.Integer, default = 0, nullable = False) #How many 5 star reviews their exercises have
+    diet_count = db.Column(db.Integer, default = 0, nullable = False) #How many diets the trainer has made
+    routine_count = db.Column(db.Integer, default = 0, nullable = False) #How many workout routines the trainer has made
+    top_exercises = db.Column(db.Text, default = "[]", nullable = False) #JSON list of their most favourited and reviewed exercises
+    recent_reviews = db.Column(db.Text, default = "[]", nullable = False) #JSON list of the newest reviews of their exercises
+    reconciled_at = db.Column(db.DateTime) #When the totals were last recalculated from the tables
+    @property
+    def average(self): #The average rating, or None if there are no reviews yet
+        return self.rating_sum / self.review_count if self.review_count else None
+    @property
+    def histogram(self): #The number of reviews for each star rating, from 5 stars down to 1
+        return [(stars, getattr(self, f"star_{stars}")) for stars in range(5, 0, -1)]
 class Diets(db.Model):
     id = db.Column(db.Integer, primary_key = True) #Creates a unique ID integer for each user
     name = db.Column(db.String(250), nullable = False) #Name of the diet
@@ -57,3 +130,10 @@ class WorkoutRoutine(db.Model):
     difficulty = db.Column(db.String(20)) #Difficulty of workout routine
     trainer_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable = False) #Id of the trainer who made the diet 
     trainer = db.relationship("User", backref="Workout_Routine") #Creates an object-level relationship between the user and WorkoutRoutine table. Backref creates the reverse relationship while enabling the tables to be called on later.
+class SyncReceipt(db.Model): #A table that remembers which offline entries have already been saved, so a retried sync never saves the same workout or meal twice
+    id = db.Column(db.Integer, primary_key = True) #Creates a unique ID integer for each receipt
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable = False) #The user who logged the entry
+    idempotency_key = db.Column(db.String(64), nullable = False) #The random key the service worker gave the entry when it was queued
+    kind = db.Column(db.String(20), nullable = False) #Whether the entry was a workout or calories
+    created_at = db.Column(db.DateTime, default = datetime.utcnow, nullable = False) #When the entry was synced
+    __table_args__ = (db.UniqueConstraint("user_id", "idempotency_key"), ) #Database blocks the same entry being saved twice
@@ -0,0 +1,80 @@
+import queue #A thread-safe queue that requests put their writes on
+import threading #Runs the writer in its own thread
+from concurrent.futures import Future #Lets a request wait for the result of its write
+from DB_Models import db #The database controller
+
+class GroupCommitter: #Collects writes from many requests and saves them in one transaction, so SQLite does one commit (and one wait for the disk) for the whole group instead of one per request
+    def __init__(self, app, max_batch = 64, max_wait = 0.005):
+        self.app = app #The writer thread needs the app to use the database
+        self.max_batch = max_batch #The most writes saved in one transaction
+        self.max_wait = max_wait #How many seconds the writer waits for more writes to join a group before committing
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.jobs = 0
+
+    def _start(self): #Starts the writer thread the first time a write is submitted
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target = self._run, name = "group-commit", daemon = True)
+                self._thread.start()
+
+    def submit(self, job): #Queues a write. job is a function that takes the database session and makes its changes (without committing). Returns a Future that gets the job's return value once the group is committed
+        future = Future()
+        self._start()
+        self._queue.put((job, future))
+        return future
+
+    def run(self, job, timeout = 30): #Queues a write and waits for it to be committed. Raises the job's exception if it failed
+        return self.submit(job).result(timeout = timeout)
+
+    def _collect(self): #Waits for one write, then gathers any more that arrive within max_wait
+        batch = [self._queue.get()]
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get(timeout = self.max_wait))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self): #The writer thread: saves one group after another, forever
+        while True:
+            batch = self._collect()
+            with self.app.app_context():
+                try:
+                    self._commit_group(batch)
+                finally:
+                    db.session.remove() #Gives the connection back to the pool between groups
+
+    def _commit_group(self, batch): #Runs every job in one transaction. If any job fails, the group is rolled back and each job is run again in its own transaction so one bad write can't lose the others
+        results = []
+        try:
+            for job, future in batch:
+                results.append(job(db.session))
+                db.session.flush() #Sends the job's changes now so a failing job is found before the commit
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            for job, future in batch:
+                self._commit_single(job, future)
+            return
+        self.batches += 1
+        self.jobs += len(batch)
+        for (job, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def _commit_single(self, job, future): #Runs one job in its own transaction
+        try:
+            result = job(db.session)
+            db.session.commit()
+        except Exception as error:
+            db.session.rollback()
+            future.set_exception(error)
+            return
+        self.batches += 1
+        self.jobs += 1
+        future.set_result(result)
+
+    def stats(self): #How many groups and writes have been committed, and how many writes are waiting
+        return {"batches": self.batches, "jobs": self.jobs, "queued": self._queue.qsize(), "jobs_per_batch": self.jobs / self.batches if self.batches else 0.0}
@@ -0,0 +1,142 @@
+import threading #Keeps the counters safe when several requests update them at once, and keeps each request's SQL totals separate
+import time #Times requests and SQL statements
+from bisect import bisect_left #Finds which histogram bucket a value falls in
+from flask import request, has_request_context #request: The request being timed. has_request_context: Checks whether SQL is being run for a request
+from sqlalchemy import event #Lets code run before and after every SQL statement
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) #Upper bounds in seconds of the request latency histogram (the Prometheus defaults)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100) #Upper bounds of the queries-per-request histogram. A route whose requests land in the top buckets probably has an N+1 query
+COUNTER_KEYS = {"hits", "misses", "evictions", "invalidations", "batches", "jobs", "runs", "failures"} #Stats that only ever go up, shown as Prometheus counters
+MAX_STATEMENT_LENGTH = 500 #Slow query logs are cut to this many characters
+NO_ENDPOINT = "none" #The label used for SQL run outside a request (command line tools, the group commit thread) and for URLs that matched no route
+
+class Histogram: #Counts how many values fell in each bucket, plus their sum, like a Prometheus histogram
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) #The last count is for values above the largest bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels): #The histogram in the Prometheus text format. Bucket counts are cumulative
+        total = 0
+        for bound, count in zip(self.buckets + ("+Inf", ), self.counts):
+            total += count
+            yield f"{name}_bucket{{{labels},le=\"{bound}\"}} {total}"
+        yield f"{name}_sum{{{labels}}} {self.sum}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+class Metrics: #Every request's latency, SQL query count and SQL time, grouped by route. Each worker process keeps its own, so Prometheus should scrape every worker
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {} #(endpoint, method) -> Histogram of seconds
+        self.queries = {} #(endpoint, method) -> Histogram of statements per request
+        self.requests = {} #(endpoint, method, status) -> count
+        self.sql_statements = {} #endpoint -> count, including statements run while a response is streamed
+        self.sql_seconds = {} #endpoint -> seconds spent waiting for SQLite
+        self.slow_requests = {} #endpoint -> count
+        self.slow_queries = {} #endpoint -> count
+
+    def observe_request(self, endpoint, method, status, seconds, queries):
+        key = (endpoint, method)
+        with self._lock:
+            self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.queries.setdefault(key, Histogram(QUERY_BUCKETS)).observe(queries)
+            self.requests[(endpoint, method, status)] = self.requests.get((endpoint, method, status), 0) + 1
+
+    def observe_query(self, endpoint, seconds, slow):
+        with self._lock:
+            self.sql_statements[endpoint] = self.sql_statements.get(endpoint, 0) + 1
+            self.sql_seconds[endpoint] = self.sql_seconds.get(endpoint, 0.0) + seconds
+            if slow:
+                self.slow_queries[endpoint] = self.slow_queries.get(endpoint, 0) + 1
+
+    def observe_slow_request(self, endpoint):
+        with self._lock:
+            self.slow_requests[endpoint] = self.slow_requests.get(endpoint, 0) + 1
+
+    def render(self, stats = None): #Everything in the Prometheus text format. stats adds other counters, e.g. {"catalogue_cache": catalogue_cache.stats()}
+        lines = []
+        def header(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+        with self._lock:
+            header("fitfresh_request_duration_seconds", "histogram", "Time taken to build each response, by route")
+            for (endpoint, method), histogram in sorted(self.latency.items()):
+                lines.extend(histogram.lines("fitfresh_request_duration_seconds", f"endpoint=\"{endpoint}\",method=\"{method}\""))
+            header("fitfresh_request_queries", "histogram", "SQL statements run by each request, by route")
+            for (endpoint, method), histogram in sorted(self.queries.items()):
+                lines.extend(histogram.lines("fitfresh_request_queries", f"endpoint=\"{endpoint}\",method=\"{method}\""))
+            header("fitfresh_requests_total", "counter", "Requests handled, by route and status code")
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f"fitfresh_requests_total{{endpoint=\"{endpoint}\",method=\"{method}\",status=\"{status}\"}} {count}")
+            for name, values, help_text in (
+                ("fitfresh_sql_statements_total", self.sql_statements, "SQL statements run, by route"),
+                ("fitfresh_sql_duration_seconds_total", self.sql_seconds, "Time spent running SQL statements, by route"),
+                ("fitfresh_slow_queries_total", self.slow_queries, "SQL statements slower than the slow query threshold, by route"),
+                ("fitfresh_slow_requests_total", self.slow_requests, "Requests slower than the slow request threshold, by route"),
+            ):
+                header(name, "counter", help_text)
+                for endpoint, value in sorted(values.items()):
+                    lines.append(f"{name}{{endpoint=\"{endpoint}\"}} {value}")
+        for source, values in (stats or {}).items():
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"fitfresh_{source}_{key}_total" if key in COUNTER_KEYS else f"fitfresh_{source}_{key}"
+                header(name, "counter" if key in COUNTER_KEYS else "gauge", f"{key.replace('_', ' ')} from {source.replace('_', ' ')}")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+def instrument(app, engine, metrics, slow_query_ms = 100, slow_request_ms = 500): #Times every request and every SQL statement, logs the slow ones and records them in metrics
+    current = threading.local() #The request this thread is handling, and its SQL totals so far
+
+    def endpoint(): #The route SQL is being run for. Uses the request itself rather than current so statements run while a response is streamed are still counted against its route
+        return (request.endpoint or NO_ENDPOINT) if has_request_context() else NO_ENDPOINT
+
+    @app.before_request
+    def start_request():
+        current.endpoint = request.endpoint or NO_ENDPOINT
+        current.queries = 0
+        current.db_seconds = 0.0
+        current.start = time.perf_counter()
+
+    @app.after_request
+    def finish_request(response): #Also runs for error responses. For streamed responses (exports) it times building the response, the streaming itself shows up in the SQL counters
+        if not hasattr(current, "start"):
+            return response
+        seconds = time.perf_counter() - current.start
+        metrics.observe_request(current.endpoint, request.method, response.status_code, seconds, current.queries)
+        if seconds * 1000 >= slow_request_ms:
+            metrics.observe_slow_request(current.endpoint)
+            app.logger.warning("Slow request %s %s (%s) took %.0f ms with %d queries (%.0f ms in SQL)", request.method, request.full_path.rstrip("?"), current.endpoint, seconds * 1000, current.queries, current.db_seconds * 1000)
+        return response
+
+    @app.teardown_request
+    def end_request(error = None): #Forgets the request's totals so they can't leak into the next request on this thread
+        current.__dict__.clear()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def finish_query(connection, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - connection.info["query_start"].pop()
+        slow = seconds * 1000 >= slow_query_ms
+        if hasattr(current, "queries"):
+            current.queries += 1
+            current.db_seconds += seconds
+        metrics.observe_query(endpoint(), seconds, slow)
+        if slow: #The statement is logged without its parameters, which can include password hashes
+            app.logger.warning("Slow query in %s took %.0f ms: %s", endpoint(), seconds * 1000, " ".join(statement.split())[:MAX_STATEMENT_LENGTH])
+
+    @event.listens_for(engine, "handle_error")
+    def failed_query(exception_context): #A statement that raised never reaches after_cursor_execute, so its start time is removed here
+        starts = exception_context.connection.info.get("query_start") if exception_context.connection is not None else None
+        if starts:
+            starts.pop()
@@ -0,0 +1,80 @@
+from sqlalchemy import text #text: Allows raw SQL statements to be run through SQLAlchemy
+from DB_Models import db #Imports the database controller so the migrations can run against the same database as the app
+from Ratings import rebuild_rating_summaries #Fills the rating summary table from the existing reviews
+from Rollups import rebuild_rollups #Fills the daily and weekly calorie totals from the existing calorie entries
+from Search import create_search_index #Creates the full text search index over the exercise catalogue
+from Recommendations import rebuild_recommendations #Fills the exercise similarities and suggestions from the existing favourites and reviews
+from Trainer_Stats import reconcile_trainer_stats #Fills the per-trainer totals from the existing exercises, favourites and reviews
+
+#Each migration is a (version, function) pair. SQLite stores the version of the newest applied migration in "PRAGMA user_version", so every migration only ever runs once on an existing instance/app.db file.
+MIGRATIONS = []
+
+def migration(version): #A decorator that registers a function as the migration for a particular schema version
+    def register(function):
+        MIGRATIONS.append((version, function))
+        return function
+    return register
+
+@migration(1)
+def add_history_indexes(connection): #Adds the composite indexes used by the workout and calorie history pages to databases created before they existed
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_workout_user_date ON workout (user_id, workout_date)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_calorie_entry_user_date ON calorie_entry (user_id, entry_date)"))
+
+@migration(2)
+def add_rating_summaries(connection): #Indexes reviews by exercise and fills the new rating summary table from the reviews already saved
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_review_exercise_exercise ON review__exercise (exercise_id)"))
+    rebuild_rating_summaries(connection)
+
+def column_exists(connection, table, column): #Checks whether a table already has a column, since SQLite has no "ADD COLUMN IF NOT EXISTS"
+    return any(row[1] == column for row in connection.execute(text(f'PRAGMA table_info("{table}")')))
+
+@migration(3)
+def add_timezones_and_calorie_rollups(connection): #Gives every user a timezone (existing users keep Sydney time) and fills the new daily and weekly calorie totals
+    if not column_exists(connection, "user", "timezone"):
+        connection.execute(text("ALTER TABLE user ADD COLUMN timezone VARCHAR(50) NOT NULL DEFAULT 'Australia/Sydney'"))
+    rebuild_rollups(connection)
+
+@migration(4)
+def add_exercise_search(connection): #Adds the full text search table, its triggers, and the indexes used for filtering by muscle group and difficulty
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_exercise_muscle_group ON exercise (muscle_group)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_exercise_difficulty ON exercise (difficulty)"))
+    create_search_index(connection)
+
+@migration(5)
+def add_user_versions(connection): #Adds the version stamp used for ETags. Existing users start at version 0, last changed now
+    if not column_exists(connection, "user", "data_version"):
+        connection.execute(text("ALTER TABLE user ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0"))
+    if not column_exists(connection, "user", "data_updated_at"):
+        connection.execute(text("ALTER TABLE user ADD COLUMN data_updated_at DATETIME"))
+    connection.execute(text("UPDATE user SET data_updated_at = CURRENT_TIMESTAMP WHERE data_updated_at IS NULL"))
+
+@migration(6)
+def add_recommendations(connection): #Fills the new like count, similarity and suggestion tables from the favourites and reviews already saved
+    rebuild_recommendations(connection)
+
+@migration(7)
+def add_trainer_stats(connection): #Indexes favourites by exercise and fills the new trainer totals table
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_favourite_exercise_exercise ON favourite__exercise (exercise_id)"))
+    reconcile_trainer_stats(connection)
+
+@migration(8)
+def add_exercise_trainer_index(connection): #Indexes exercises by trainer, so the trainer totals can be recalculated a few trainers at a time
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_exercise_trainer ON exercise (trainer_id)"))
+
+@migration(9)
+def add_rating_summary_times(connection): #Records when each exercise's rating summary last changed, so the pages showing ratings can get a new ETag without reloading the catalogue cache
+    if not column_exists(connection, "exercise_rating_summary", "updated_at"):
+        connection.execute(text("ALTER TABLE exercise_rating_summary ADD COLUMN updated_at DATETIME"))
+    connection.execute(text("UPDATE exercise_rating_summary SET updated_at = CURRENT_TIMESTAMP WHERE updated_at IS NULL"))
+
+def upgrade_database(): #Creates any missing tables and then applies every migration newer than the version stored in the database. Must be called inside an app context
+    db.create_all() #Creates tables that don't exist yet (new databases get the full schema straight away)
+    with db.engine.begin() as connection: #Runs every pending migration in a single transaction so a failed upgrade leaves the database untouched
+        connection.execute(text("BEGIN IMMEDIATE")) #The SQLite driver only opens a transaction by itself before INSERT, UPDATE and DELETE, so without this the CREATE, ALTER and PRAGMA statements would each be saved straight away. IMMEDIATE also takes the write lock, so two workers starting at once can't both run the same migrations
+        current_version = connection.execute(text("PRAGMA user_version")).scalar()
+        for version, function in sorted(MIGRATIONS, key = lambda pair: pair[0]):
+            if version > current_version:
+                function(connection)
+                connection.execute(text(f"PRAGMA user_version = {int(version)}")) #PRAGMA statements can't use bound parameters so the version is formatted in as an integer
+                current_version = version
+    return current_version
@@ -0,0 +1,40 @@
+import math #Rounds half-star ratings the same way SQLite does
+from datetime import datetime #Records when each summary last changed
+from sqlalchemy import text #text: Allows raw SQL statements to be run through SQLAlchemy
+from sqlalchemy.dialects.sqlite import insert #SQLite's INSERT, which supports "ON CONFLICT DO UPDATE" (an upsert)
+from DB_Models import ExerciseRatingSummary #The table that stores the running rating totals
+
+STARS = "MIN(MAX(CAST(ROUND(rating) AS INTEGER), 1), 5)" #Which star a rating counts towards, worked out in SQL by the rebuilds. SQLite's ROUND rounds halves up (2.5 -> 3)
+
+def rating_stars(rating): #Which star a rating counts towards, by the same rule as STARS. Python's round() rounds halves to the nearest even number (2.5 -> 2), so it can't be used here
+    return min(max(math.floor(rating + 0.5), 1), 5)
+
+def record_rating(session, exercise_id, rating): #Adds one rating to the exercise's summary. Runs in the caller's transaction so the review and the summary are saved together
+    stars = rating_stars(rating) #Which histogram column the rating belongs to
+    star_column = f"star_{stars}"
+    statement = insert(ExerciseRatingSummary).values(exercise_id = exercise_id, review_count = 1, rating_sum = stars, updated_at = datetime.utcnow(), **{star_column: 1})
+    statement = statement.on_conflict_do_update( #If the exercise already has a summary the totals are increased inside the database, so two reviews saved at the same time can't overwrite each other
+        index_elements = [ExerciseRatingSummary.exercise_id],
+        set_ = {
+            "review_count": ExerciseRatingSummary.review_count + 1,
+            "rating_sum": ExerciseRatingSummary.rating_sum + stars,
+            star_column: getattr(ExerciseRatingSummary, star_column) + 1,
+            "updated_at": statement.excluded.updated_at,
+        },
+    )
+    session.execute(statement)
+
+def summary_to_dict(summary): #Turns a summary row into a dictionary the templates can use. Exercises without reviews get an empty summary
+    if summary is None:
+        return {"review_count": 0, "rating_average": None, "histogram": [(stars, 0) for stars in range(5, 0, -1)]}
+    return {"review_count": summary.review_count, "rating_average": summary.average, "histogram": summary.histogram}
+
+def rebuild_rating_summaries(connection): #Recalculates every summary from the review table. Used to fill the table for existing databases
+    connection.execute(text("DELETE FROM exercise_rating_summary"))
+    connection.execute(text(f"""
+        INSERT INTO exercise_rating_summary (exercise_id, review_count, rating_sum, star_1, star_2, star_3, star_4, star_5, updated_at)
+        SELECT exercise_id, COUNT(*), SUM(stars),
+               SUM(stars = 1), SUM(stars = 2), SUM(stars = 3), SUM(stars = 4), SUM(stars = 5), CURRENT_TIMESTAMP
+        FROM (SELECT exercise_id, {STARS} AS stars FROM review__exercise)
+        GROUP BY exercise_id
+    """))
@@ -0,0 +1,122 @@
+from datetime import datetime #Records when an exercise's similarities last changed
+from sqlalchemy import text, delete #text: Allows raw SQL statements to be run through SQLAlchemy. delete: Removes rows whose counts drop to zero
+from sqlalchemy.dialects.sqlite import insert #SQLite's INSERT, which supports "ON CONFLICT DO UPDATE" (an upsert)
+from DB_Models import ExerciseLikeCount, ExerciseSimilarity, ExerciseSimilarityVersion #The tables the like counts, similarities and their version stamps are saved to
+
+LIKE_RATING = 4 #A review with at least this many stars counts as liking the exercise, the same as favouriting it
+SHRINKAGE = 5 #Added to the bottom of the similarity score so pairs liked by only one or two users don't come out as perfectly similar
+TOP_K = 20 #How many suggestions are stored for each user
+SHOWN = 5 #How many similar exercises and suggestions the pages show
+
+#Every exercise each user likes: their favourites plus the exercises they rated LIKE_RATING stars or more. The unique (user_id, exercise_id) constraints on both tables make the per-user version an index lookup
+ALL_LIKES = "SELECT user_id, exercise_id FROM favourite__exercise UNION SELECT user_id, exercise_id FROM review__exercise WHERE rating >= :like_rating"
+USER_LIKES = "SELECT user_id, exercise_id FROM favourite__exercise WHERE user_id = :user_id UNION SELECT user_id, exercise_id FROM review__exercise WHERE user_id = :user_id AND rating >= :like_rating"
+
+#How similar two exercises are: the number of users who like both, divided by the number who like either (the Jaccard index) plus SHRINKAGE
+SCORE = """co_count * 1.0 / (
+    COALESCE((SELECT like_count FROM exercise_like_count c WHERE c.exercise_id = exercise_similarity.exercise_id), 0)
+    + COALESCE((SELECT like_count FROM exercise_like_count c WHERE c.exercise_id = exercise_similarity.similar_id), 0)
+    - co_count + :shrinkage)"""
+
+#Works out the TOP_K best suggestions for each user in "likes": the exercises most similar to the ones they like, added up over everything they like, leaving out what they already like
+RECOMMEND = """
+    WITH likes AS ({likes})
+    INSERT INTO exercise_recommendation (user_id, rank, exercise_id, score)
+    SELECT user_id, rank, exercise_id, score FROM (
+        SELECT l.user_id, s.similar_id AS exercise_id, SUM(s.score) AS score,
+               ROW_NUMBER() OVER (PARTITION BY l.user_id ORDER BY SUM(s.score) DESC, s.similar_id) AS rank
+        FROM likes l JOIN exercise_similarity s ON s.exercise_id = l.exercise_id
+        WHERE NOT EXISTS (SELECT 1 FROM likes mine WHERE mine.user_id = l.user_id AND mine.exercise_id = s.similar_id)
+        GROUP BY l.user_id, s.similar_id
+    ) WHERE rank <= :top_k
+"""
+
+def user_likes(executor, user_id, exercise_id): #Whether the user currently likes the exercise
+    return executor.execute(text(f"SELECT 1 FROM ({USER_LIKES}) WHERE exercise_id = :exercise_id"), {"user_id": user_id, "exercise_id": exercise_id, "like_rating": LIKE_RATING}).first() is not None
+
+def track_likes(db_session, user_id, exercise_id, change): #Runs change(db_session) (adding or removing a favourite or review) and, if it changed whether the user likes the exercise, updates the similarities and the user's suggestions in the same transaction. Returns what change returned
+    before = user_likes(db_session, user_id, exercise_id)
+    result = change(db_session)
+    db_session.flush() #Sends the change so the check below can see it
+    after = user_likes(db_session, user_id, exercise_id)
+    if before != after:
+        apply_like(db_session, user_id, exercise_id, 1 if after else -1)
+        refresh_user(db_session, user_id)
+    return result
+
+def _add(executor, model, index_elements, column, rows): #Adds each row's count to the matching row, creating any that don't exist yet
+    statement = insert(model)
+    statement = statement.on_conflict_do_update(index_elements = index_elements, set_ = {column: getattr(model, column) + getattr(statement.excluded, column)}) #Counted inside the database, so two likes saved at the same time can't overwrite each other
+    executor.execute(statement, rows)
+
+def apply_like(executor, user_id, exercise_id, sign): #Updates the counts after a user starts (sign 1) or stops (sign -1) liking an exercise. Only the pairs between this exercise and the user's other likes change, so it costs one row per exercise the user likes
+    others = [row[0] for row in executor.execute(text(f"SELECT exercise_id FROM ({USER_LIKES}) WHERE exercise_id != :exercise_id"), {"user_id": user_id, "exercise_id": exercise_id, "like_rating": LIKE_RATING})]
+    _add(executor, ExerciseLikeCount, [ExerciseLikeCount.exercise_id], "like_count", [{"exercise_id": exercise_id, "like_count": sign}])
+    executor.execute(delete(ExerciseLikeCount).where(ExerciseLikeCount.exercise_id == exercise_id, ExerciseLikeCount.like_count <= 0))
+    if others:
+        pairs = [{"exercise_id": exercise_id, "similar_id": other, "co_count": sign, "score": 0} for other in others]
+        pairs += [{"exercise_id": other, "similar_id": exercise_id, "co_count": sign, "score": 0} for other in others] #Each pair is stored both ways round
+        _add(executor, ExerciseSimilarity, [ExerciseSimilarity.exercise_id, ExerciseSimilarity.similar_id], "co_count", pairs)
+        if sign < 0: #Pairs no user likes any more are removed, both ways round
+            executor.execute(delete(ExerciseSimilarity).where(ExerciseSimilarity.exercise_id == exercise_id, ExerciseSimilarity.similar_id.in_(others), ExerciseSimilarity.co_count <= 0))
+            executor.execute(delete(ExerciseSimilarity).where(ExerciseSimilarity.exercise_id.in_(others), ExerciseSimilarity.similar_id == exercise_id, ExerciseSimilarity.co_count <= 0))
+    #The exercise's like count changed, so every pair it is part of gets a new score
+    parameters = {"exercise_id": exercise_id, "shrinkage": SHRINKAGE}
+    executor.execute(text(f"UPDATE exercise_similarity SET score = {SCORE} WHERE exercise_id = :exercise_id"), parameters)
+    executor.execute(text(f"UPDATE exercise_similarity SET score = {SCORE} WHERE similar_id = :exercise_id AND exercise_id IN (SELECT similar_id FROM exercise_similarity WHERE exercise_id = :exercise_id)"), parameters) #The reverse rows, found through the primary key
+    #The "also liked" lists that changed: this exercise's, and every exercise it is (or was, for pairs just removed) paired with
+    paired = [row[0] for row in executor.execute(text("SELECT similar_id FROM exercise_similarity WHERE exercise_id = :exercise_id"), {"exercise_id": exercise_id})]
+    bump_similarity_versions(executor, {exercise_id, *others, *paired})
+
+def bump_similarity_versions(executor, exercise_ids): #Gives each exercise's "also liked" list a new version stamp. Runs in the caller's transaction
+    if not exercise_ids:
+        return
+    statement = insert(ExerciseSimilarityVersion)
+    statement = statement.on_conflict_do_update(index_elements = [ExerciseSimilarityVersion.exercise_id], set_ = {"version": ExerciseSimilarityVersion.version + 1, "updated_at": statement.excluded.updated_at})
+    now = datetime.utcnow()
+    executor.execute(statement, [{"exercise_id": exercise_id, "version": 1, "updated_at": now} for exercise_id in sorted(exercise_ids)])
+
+def refresh_user(executor, user_id): #Works out one user's suggestions again from their current likes
+    executor.execute(text("DELETE FROM exercise_recommendation WHERE user_id = :user_id"), {"user_id": user_id})
+    executor.execute(text(RECOMMEND.format(likes = USER_LIKES)), {"user_id": user_id, "like_rating": LIKE_RATING, "top_k": TOP_K})
+
+def rebuild_recommendations(executor): #Works out every like count, similarity and suggestion again from the favourites and reviews. Used to fill the tables for existing databases and by "flask --app App rebuild-recommendations"
+    parameters = {"like_rating": LIKE_RATING, "shrinkage": SHRINKAGE, "top_k": TOP_K}
+    for table in ("exercise_recommendation", "exercise_similarity", "exercise_like_count"):
+        executor.execute(text(f"DELETE FROM {table}"))
+    executor.execute(text("DROP TABLE IF EXISTS temp.all_likes"))
+    executor.execute(text(f"CREATE TEMP TABLE all_likes AS {ALL_LIKES}"), parameters) #Worked out once and indexed, since every step below reads it
+    executor.execute(text("CREATE INDEX temp.ix_all_likes_user ON all_likes (user_id, exercise_id)"))
+    executor.execute(text("INSERT INTO exercise_like_count (exercise_id, like_count) SELECT exercise_id, COUNT(*) FROM all_likes GROUP BY exercise_id"))
+    executor.execute(text("""
+        INSERT INTO exercise_similarity (exercise_id, similar_id, co_count, score)
+        SELECT a.exercise_id, b.exercise_id, COUNT(*), 0
+        FROM all_likes a JOIN all_likes b ON b.user_id = a.user_id AND b.exercise_id != a.exercise_id
+        GROUP BY a.exercise_id, b.exercise_id
+    """)) #Every pair of exercises liked by the same user, counted over all users
+    executor.execute(text(f"UPDATE exercise_similarity SET score = {SCORE}"), parameters)
+    executor.execute(text(RECOMMEND.format(likes = "SELECT user_id, exercise_id FROM all_likes")), parameters)
+    executor.execute(text("DROP TABLE temp.all_likes"))
+    bump_similarity_versions(executor, [row[0] for row in executor.execute(text("SELECT id FROM exercise"))]) #Any list may have changed
+
+def similar_exercises(executor, exercise_id, limit = SHOWN): #The exercises most liked by users who like this one, read from the precomputed similarities with one index lookup
+    return executor.execute(text("""
+        SELECT e.id, e.name, e.muscle_group, e.difficulty, e.image_url, s.score
+        FROM exercise_similarity s JOIN exercise e ON e.id = s.similar_id
+        WHERE s.exercise_id = :exercise_id ORDER BY s.score DESC LIMIT :limit
+    """), {"exercise_id": exercise_id, "limit": limit}).mappings().all()
+
+def recommended_exercises(executor, user_id, limit = SHOWN): #The user's stored suggestions. Users who don't like anything yet (or whose likes have no similar exercises) get the most liked exercises they don't already like
+    rows = executor.execute(text("""
+        SELECT e.id, e.name, e.muscle_group, e.difficulty, e.image_url, r.score
+        FROM exercise_recommendation r JOIN exercise e ON e.id = r.exercise_id
+        WHERE r.user_id = :user_id ORDER BY r.rank LIMIT :limit
+    """), {"user_id": user_id, "limit": limit}).mappings().all()
+    if rows:
+        return rows
+    return executor.execute(text(f"""
+        SELECT e.id, e.name, e.muscle_group, e.difficulty, e.image_url, c.like_count AS score
+        FROM exercise_like_count c JOIN exercise e ON e.id = c.exercise_id
+        WHERE c.exercise_id NOT IN (SELECT exercise_id FROM ({USER_LIKES}))
+        ORDER BY c.like_count DESC LIMIT :limit
+    """), {"user_id": user_id, "like_rating": LIKE_RATING, "limit": limit}).mappings().all()
@@ -0,0 +1,71 @@
+from collections import defaultdict #A dictionary that starts every new key at a default value, used to add up the totals for each day
+from datetime import datetime, timedelta, timezone #datetime/timezone: Read ISO times and convert them to UTC. timedelta: Used to find the Monday each week starts on
+from functools import lru_cache #Remembers the results of a function so it isn't run again for the same input
+import pytz #A timezone database to convert to other timezones
+from sqlalchemy import delete, select #delete/select: Build the statements used to rebuild the totals
+from sqlalchemy.dialects.sqlite import insert #SQLite's INSERT, which supports "ON CONFLICT DO UPDATE" (an upsert)
+from DB_Models import User, CalorieEntry, DailyCalorieRollup, WeeklyCalorieRollup #The tables the totals are calculated from and saved to
+
+DEFAULT_TIMEZONE = "Australia/Sydney" #The timezone used for users who haven't chosen one
+
+@lru_cache(maxsize = None) #Looking a timezone up is slow, so each one is only loaded once
+def get_timezone(name): #Returns the timezone object for a name such as "Australia/Sydney"
+    return pytz.timezone(name or DEFAULT_TIMEZONE)
+
+def is_valid_timezone(name): #Checks that a name is a real timezone
+    return name in pytz.all_timezones_set
+
+def local_time(utc_dt, timezone_name = DEFAULT_TIMEZONE): #Converts a UTC time from the database to the user's timezone
+    return utc_dt.replace(tzinfo = pytz.utc).astimezone(get_timezone(timezone_name))
+
+def parse_utc_time(value): #Reads an ISO date and time and converts it to UTC without a timezone, which is how the database stores times. Times without an offset are taken to be UTC already
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00")) #JavaScript's toISOString() ends in "Z", which older versions of Python can't read
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo = None)
+    return parsed
+
+def _totals(entries, timezone_name, sign): #Adds up the calories and meal counts of (entry_date, calories) pairs for each local day and week. sign is 1 when entries are added and -1 when they are removed
+    daily = defaultdict(lambda: [0.0, 0])
+    weekly = defaultdict(lambda: [0.0, 0])
+    for entry_date, calories in entries:
+        day = local_time(entry_date, timezone_name).date()
+        week = day - timedelta(days = day.weekday()) #The Monday of that week
+        for totals in (daily[day], weekly[week]):
+            totals[0] += sign * calories
+            totals[1] += sign
+    return daily, weekly
+
+def _upsert(executor, model, date_column, user_id, totals): #Adds the totals to the matching rows, creating any that don't exist yet, with one statement per table
+    if not totals:
+        return
+    rows = [{"user_id": user_id, date_column: day, "total_calories": calories, "meal_count": meals} for day, (calories, meals) in totals.items()]
+    statement = insert(model)
+    statement = statement.on_conflict_do_update( #The totals are increased inside the database, so two meals saved at the same time can't overwrite each other
+        index_elements = [model.user_id, getattr(model, date_column)],
+        set_ = {"total_calories": model.total_calories + statement.excluded.total_calories, "meal_count": model.meal_count + statement.excluded.meal_count},
+    )
+    executor.execute(statement, rows)
+    executor.execute(delete(model).where(model.user_id == user_id, model.meal_count <= 0)) #Removes days and weeks that no longer have any meals
+
+def apply_entries(executor, user_id, timezone_name, entries, sign = 1): #Updates the daily and weekly totals for a group of calorie entries. Runs in the caller's transaction so the entries and the totals are saved together
+    daily, weekly = _totals(entries, timezone_name, sign)
+    _upsert(executor, DailyCalorieRollup, "local_date", user_id, daily)
+    _upsert(executor, WeeklyCalorieRollup, "week_start", user_id, weekly)
+
+def add_entry(executor, user_id, timezone_name, entry_date, calories): #Adds one calorie entry to the totals
+    apply_entries(executor, user_id, timezone_name, [(entry_date, calories)], sign = 1)
+
+def remove_entry(executor, user_id, timezone_name, entry_date, calories): #Takes one calorie entry away from the totals
+    apply_entries(executor, user_id, timezone_name, [(entry_date, calories)], sign = -1)
+
+def rebuild_rollups(executor, user_id = None, batch_size = 5000): #Recalculates the totals from the calorie entries, for one user or (with no user_id) for everyone. Used to fill the tables for existing data and after a user changes timezone
+    users = select(User.id, User.timezone)
+    if user_id is not None:
+        users = users.where(User.id == user_id)
+    for current_user_id, timezone_name in executor.execute(users).all():
+        executor.execute(delete(DailyCalorieRollup).where(DailyCalorieRollup.user_id == current_user_id))
+        executor.execute(delete(WeeklyCalorieRollup).where(WeeklyCalorieRollup.user_id == current_user_id))
+        entries = executor.execute(select(CalorieEntry.entry_date, CalorieEntry.calories).where(CalorieEntry.user_id == current_user_id).execution_options(yield_per = batch_size)) #Streams the entries instead of loading them all at once
+        daily, weekly = _totals(entries, timezone_name, 1)
+        _upsert(executor, DailyCalorieRollup, "local_date", current_user_id, daily)
+        _upsert(executor, WeeklyCalorieRollup, "week_start", current_user_id, weekly)
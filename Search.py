@@ -0,0 +1,74 @@
+import re #Regular expressions, used to split a search into words
+from sqlalchemy import text #text: Allows raw SQL statements to be run through SQLAlchemy
+from DB_Models import db #The database controller
+
+FACETS = ("muscle_group", "difficulty") #The columns results can be filtered and counted by
+NAME_WEIGHT, DESCRIPTION_WEIGHT, MUSCLE_WEIGHT = 10.0, 1.0, 5.0 #How much a match in each column counts towards the ranking. A match in the name matters most
+MAX_TERMS = 10 #The most words used from one search
+
+def create_search_index(connection): #Creates the full text search table and the triggers that keep it in step with the exercise table, then fills it with the existing exercises
+    connection.execute(text("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS exercise_fts USING fts5(
+            name, description, muscle_group,
+            content = 'exercise', content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        )
+    """)) #An external content table: the text stays in the exercise table and the search table only stores the index. prefix='2 3' keeps extra indexes so short prefix searches are fast
+    connection.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS exercise_fts_insert AFTER INSERT ON exercise BEGIN
+            INSERT INTO exercise_fts (rowid, name, description, muscle_group) VALUES (new.id, new.name, new.description, new.muscle_group);
+        END
+    """))
+    connection.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS exercise_fts_delete AFTER DELETE ON exercise BEGIN
+            INSERT INTO exercise_fts (exercise_fts, rowid, name, description, muscle_group) VALUES ('delete', old.id, old.name, old.description, old.muscle_group);
+        END
+    """))
+    connection.execute(text("""
+        CREATE TRIGGER IF NOT EXISTS exercise_fts_update AFTER UPDATE ON exercise BEGIN
+            INSERT INTO exercise_fts (exercise_fts, rowid, name, description, muscle_group) VALUES ('delete', old.id, old.name, old.description, old.muscle_group);
+            INSERT INTO exercise_fts (rowid, name, description, muscle_group) VALUES (new.id, new.name, new.description, new.muscle_group);
+        END
+    """))
+    connection.execute(text("INSERT INTO exercise_fts (exercise_fts) VALUES ('rebuild')")) #Indexes every exercise already in the table
+
+def match_expression(query): #Turns what the user typed into an FTS5 query where every word must match the start of a word, e.g. "bench pr" -> "bench"* "pr"*. Quoting each word stops FTS5 syntax in the search from being run
+    terms = re.findall(r"\w+", query.lower())[:MAX_TERMS]
+    return " ".join(f'"{term}"*' for term in terms)
+
+def _where(match, filters, skip = None): #Builds the WHERE clause and its parameters. skip leaves out one facet's filter so its counts show what choosing another value would return
+    clauses = []
+    params = {}
+    if match:
+        clauses.append("exercise_fts MATCH :match")
+        params["match"] = match
+    for column in FACETS:
+        if column != skip and filters.get(column):
+            clauses.append(f"e.{column} = :{column}")
+            params[column] = filters[column]
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+def search_exercises(query = "", filters = None, limit = 50, offset = 0): #Searches the catalogue. Returns the matching exercises (best match first) and, for each facet, how many matches have each value
+    filters = filters or {}
+    match = match_expression(query or "")
+    source = "exercise_fts JOIN exercise e ON e.id = exercise_fts.rowid" if match else "exercise e" #Without search words the exercise table is filtered directly using its indexes
+    order = f"bm25(exercise_fts, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT}, {MUSCLE_WEIGHT}), e.id" if match else "e.name, e.id" #bm25 gives better matches a lower score
+    where, params = _where(match, filters)
+    rows = db.session.execute(text(f"""
+        SELECT e.id, e.name, e.description, e.muscle_group, e.difficulty, e.image_url, e.trainer_id,
+               COALESCE(s.review_count, 0) AS review_count, s.rating_sum
+        FROM {source} LEFT JOIN exercise_rating_summary s ON s.exercise_id = e.id
+        {where} ORDER BY {order} LIMIT :limit OFFSET :offset
+    """), {**params, "limit": limit, "offset": offset}).mappings().all()
+    results = []
+    for row in rows:
+        result = dict(row)
+        rating_sum = result.pop("rating_sum")
+        result["rating_average"] = rating_sum / result["review_count"] if result["review_count"] else None
+        results.append(result)
+    facets = {}
+    for column in FACETS:
+        where, params = _where(match, filters, skip = column)
+        facets[column] = [{"value": value, "count": count} for value, count in db.session.execute(text(f"SELECT e.{column}, COUNT(*) AS total FROM {source}{where} GROUP BY e.{column} ORDER BY total DESC, e.{column}"), params)]
+    total = sum(facet["count"] for facet in facets[FACETS[0]] if not filters.get(FACETS[0]) or facet["value"] == filters[FACETS[0]]) #The number of matches, taken from the facet counts instead of another query
+    return {"query": query, "filters": {column: filters.get(column) for column in FACETS}, "total": total, "results": results, "facets": facets}
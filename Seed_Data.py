@@ -0,0 +1,94 @@
+import random #Generates the made-up data. A fixed seed gives the same data every run so benchmarks can be compared
+from datetime import date, datetime, timedelta #Used to spread workouts and meals over the past few years
+from sqlalchemy import insert, text #insert: Builds one INSERT statement that is run for a whole batch of rows. text: Allows raw SQL statements
+from werkzeug.security import generate_password_hash #Hashes the one password every seeded user shares
+from DB_Models import db, User, Workout, CalorieEntry, Exercise, Favourite_Exercise, Review_Exercise #The tables that are filled
+from Auth import PASSWORD_HASH_METHOD #Seeded users get the same kind of hash as real users, so login benchmarks are realistic
+from Ratings import rebuild_rating_summaries #Works out the rating summaries from the seeded reviews
+from Rollups import rebuild_rollups #Works out the daily and weekly calorie totals from the seeded meals
+from Recommendations import rebuild_recommendations #Works out the similar exercises and suggestions from the seeded favourites and reviews
+from Trainer_Stats import reconcile_trainer_stats #Works out the trainer totals from the seeded exercises, favourites and reviews
+
+SEED_PASSWORD = "password" #Every seeded user can log in with this password
+EXERCISE_NAMES = ["Squat", "Bench Press", "Deadlift", "Overhead Press", "Barbell Row", "Pull Up", "Lunge", "Dip", "Curl", "Leg Press", "Hip Thrust", "Lat Pulldown"]
+MUSCLE_GROUPS = ["Legs", "Chest", "Back", "Shoulders", "Arms", "Core", "Glutes"]
+DIFFICULTIES = ["Beginner", "Intermediate", "Advanced"]
+MEALS = ["Breakfast", "Lunch", "Dinner", "Snack", "Shake"]
+HISTORY_DAYS = 3 * 365 #Workouts and meals are spread over the last three years
+
+def _spread(total, buckets, rng): #Splits a total between buckets at random, so some users have much more history than others like real users
+    weights = [rng.paretovariate(1.5) for _ in range(buckets)]
+    scale = total / sum(weights)
+    counts = [int(weight * scale) for weight in weights]
+    for index in rng.sample(range(buckets), total - sum(counts)): #Hands out the rows lost to rounding
+        counts[index] += 1
+    return counts
+
+def _insert_batches(model, rows, batch_size): #Inserts rows from a generator batch_size at a time, committing after each batch so memory use stays flat
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            db.session.execute(insert(model), batch)
+            db.session.commit()
+            batch.clear()
+    if batch:
+        db.session.execute(insert(model), batch)
+        db.session.commit()
+
+def seed(users = 100, trainers = 10, exercises = 200, workouts = 20000, calories = 20000, favourites = 1000, reviews = 1000, batch_size = 10000, random_seed = 42, log = print): #Fills the database with made-up data at the given scale. Must be called inside an app context, on an empty database
+    rng = random.Random(random_seed)
+    today = date.today()
+    now = datetime.utcnow()
+    password_hash = generate_password_hash(SEED_PASSWORD, method = PASSWORD_HASH_METHOD) #Hashed once and shared, since hashing millions of passwords would take hours
+    first_user_id = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    first_exercise_id = (db.session.query(db.func.max(Exercise.id)).scalar() or 0) + 1
+
+    log(f"Seeding {trainers} trainers and {users} gym goers")
+    _insert_batches(User, ({"username": f"trainer{index}", "password_hash": password_hash, "role": "trainer"} for index in range(trainers)), batch_size)
+    _insert_batches(User, ({"username": f"user{index}", "password_hash": password_hash, "role": "gym_goer"} for index in range(users)), batch_size)
+    trainer_ids = range(first_user_id, first_user_id + trainers)
+    user_ids = range(first_user_id + trainers, first_user_id + trainers + users)
+
+    log(f"Seeding {exercises} exercises")
+    _insert_batches(Exercise, ({
+        "name": f"{rng.choice(EXERCISE_NAMES)} {index}",
+        "description": f"Variation {index} for {rng.choice(MUSCLE_GROUPS).lower()}",
+        "muscle_group": rng.choice(MUSCLE_GROUPS),
+        "difficulty": rng.choice(DIFFICULTIES),
+        "trainer_id": rng.choice(trainer_ids),
+    } for index in range(exercises)), batch_size)
+    exercise_ids = range(first_exercise_id, first_exercise_id + exercises)
+
+    log(f"Seeding {workouts} workouts")
+    def workout_rows():
+        for user_id, count in zip(user_ids, _spread(workouts, users, rng)):
+            for _ in range(count):
+                yield {"user_id": user_id, "workout_date": today - timedelta(days = rng.randrange(HISTORY_DAYS)), "exercise": rng.choice(EXERCISE_NAMES), "sets": rng.randint(1, 5), "reps": rng.randint(1, 12), "weight": float(rng.randrange(5, 200, 5))}
+    _insert_batches(Workout, workout_rows(), batch_size)
+
+    log(f"Seeding {calories} calorie entries")
+    def calorie_rows():
+        for user_id, count in zip(user_ids, _spread(calories, users, rng)):
+            for _ in range(count):
+                yield {"user_id": user_id, "entry_date": now - timedelta(minutes = rng.randrange(HISTORY_DAYS * 24 * 60)), "meal": rng.choice(MEALS), "calories": float(rng.randrange(50, 1200))}
+    _insert_batches(CalorieEntry, calorie_rows(), batch_size)
+
+    def pair_rows(total, extra): #Picks (user, exercise) pairs with no repeats, since a user can only favourite or review an exercise once
+        for user_id, count in zip(user_ids, _spread(min(total, users * exercises), users, rng)):
+            for exercise_id in rng.sample(exercise_ids, min(count, exercises)):
+                yield {"user_id": user_id, "exercise_id": exercise_id, **extra()}
+    log(f"Seeding {favourites} favourites and {reviews} reviews")
+    _insert_batches(Favourite_Exercise, pair_rows(favourites, dict), batch_size)
+    _insert_batches(Review_Exercise, pair_rows(reviews, lambda: {"rating": rng.randint(1, 5), "comment": "Seeded review", "created_at": now - timedelta(minutes = rng.randrange(HISTORY_DAYS * 24 * 60))}), batch_size)
+
+    log("Rebuilding rating summaries, recommendations, trainer totals and calorie totals")
+    with db.engine.begin() as connection:
+        rebuild_rating_summaries(connection)
+        rebuild_recommendations(connection)
+        reconcile_trainer_stats(connection) #After the rating summaries, which it reads
+    rebuild_rollups(db.session)
+    db.session.commit()
+    db.session.execute(text("ANALYZE")) #Updates SQLite's statistics so it picks the right indexes for the new data
+    db.session.commit()
+    return {"user_ids": [user_ids.start, user_ids.stop - 1], "trainer_ids": [trainer_ids.start, trainer_ids.stop - 1], "exercise_ids": [exercise_ids.start, exercise_ids.stop - 1]}
@@ -0,0 +1,102 @@
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError #IntegrityError: Raised when two syncs try to save the same entry at the same time. SQLAlchemyError: Any other database error
+from DB_Models import db, User, Workout, CalorieEntry, SyncReceipt #The tables offline entries are saved to
+from Rollups import apply_entries, local_time, parse_utc_time #apply_entries: Keeps the daily and weekly calorie totals up to date. local_time: Finds the user's own date for a synced workout. parse_utc_time: Reads the time an offline entry was logged
+from Validation import validate_workout, validate_calories #The same checks the log-workout and log-calories forms use
+from Conditional import touch_user #Gives the user's pages a new ETag, and their training progress a new cache key, when entries are synced
+
+#The kinds of entry the service worker can queue while offline, matched to their table, checks and date column
+KINDS = {
+    "workout": {"model": Workout, "validate": validate_workout, "date_column": "workout_date"},
+    "calories": {"model": CalorieEntry, "validate": validate_calories, "date_column": "entry_date"},
+}
+MAX_BATCH = 500 #The most entries accepted in one sync request
+MAX_KEY_LENGTH = 64 #Matches the length of SyncReceipt.idempotency_key
+
+class SyncError(Exception): #Raised when the sync request as a whole is invalid
+    pass
+
+def sync_entries(user_id, entries): #Saves a batch of queued offline entries for one user in a single transaction. Returns one result per entry: created, duplicate or invalid
+    if not isinstance(entries, list):
+        raise SyncError("entries must be a list")
+    if len(entries) > MAX_BATCH:
+        raise SyncError(f"A sync can contain at most {MAX_BATCH} entries")
+    timezone_name = db.session.get(User, user_id).timezone #Workouts are dated, and calorie totals counted, in the user's own timezone
+    results = []
+    pending = [] #(result, kind, values) for the valid entries that may need saving
+    for entry in entries:
+        key = entry.get("key") if isinstance(entry, dict) else None
+        result = {"key": key}
+        results.append(result)
+        if not isinstance(key, str) or not key or len(key) > MAX_KEY_LENGTH:
+            result.update(status = "invalid", error = "Each entry needs a key of up to 64 characters")
+            continue
+        kind = entry.get("kind")
+        settings = KINDS.get(kind) if isinstance(kind, str) else None #A list or object can't be looked up in KINDS
+        if settings is None:
+            result.update(status = "invalid", error = "Unknown kind")
+            continue
+        data = entry.get("data") or {}
+        if not isinstance(data, dict):
+            result.update(status = "invalid", error = "data must be an object")
+            continue
+        values, error = settings["validate"](data) #The same checks as the form
+        if error:
+            result.update(status = "invalid", error = error)
+            continue
+        if entry.get("logged_at"):
+            try:
+                logged_at = parse_utc_time(str(entry["logged_at"]))
+                values[settings["date_column"]] = local_time(logged_at, timezone_name).date() if settings["date_column"] == "workout_date" else logged_at #The service worker sends UTC times, so a morning workout in Sydney would otherwise be filed on the day before
+            except (ValueError, OverflowError): #Times near year 1 or 9999 can overflow when converted between timezones
+                result.update(status = "invalid", error = "logged_at must be an ISO date and time")
+                continue
+        values.setdefault(settings["date_column"], settings["model"].__table__.c[settings["date_column"]].default.arg(None)) #Entries without a time are dated now, like the form
+        pending.append((result, kind, values))
+    for attempt in range(2): #If another sync saved some of the same entries first, the unique constraint stops the commit, and the batch is tried once more
+        try:
+            _save(user_id, timezone_name, pending)
+            break
+        except IntegrityError:
+            db.session.rollback()
+            if attempt == 1:
+                _save_each(user_id, timezone_name, pending)
+        except (SQLAlchemyError, OverflowError): #Something in the batch can't be saved. The driver raises OverflowError itself for numbers SQLite can't store
+            db.session.rollback()
+            _save_each(user_id, timezone_name, pending)
+            break
+    return results
+
+def _save_each(user_id, timezone_name, pending): #Saves the entries one at a time when the batch as a whole fails, so one bad entry is reported as invalid instead of failing every sync of the queue it's stuck in
+    for item in pending:
+        result, kind, values = item
+        try:
+            _save(user_id, timezone_name, [item])
+        except IntegrityError: #Either another sync saved the entry first, or the entry itself breaks a constraint
+            db.session.rollback()
+            if db.session.query(SyncReceipt.id).filter(SyncReceipt.user_id == user_id, SyncReceipt.idempotency_key == result["key"]).first():
+                result["status"] = "duplicate"
+            else:
+                result.update(status = "invalid", error = "This entry couldn't be saved")
+        except (SQLAlchemyError, OverflowError):
+            db.session.rollback()
+            result.update(status = "invalid", error = "This entry couldn't be saved")
+
+def _save(user_id, timezone_name, pending): #Saves every entry whose key hasn't been seen before, then commits once
+    keys = {result["key"] for result, kind, values in pending}
+    seen = {receipt_key for (receipt_key, ) in db.session.query(SyncReceipt.idempotency_key).filter(SyncReceipt.user_id == user_id, SyncReceipt.idempotency_key.in_(keys))} if keys else set() #One query finds every key that has already been synced
+    meals = [] #(entry_date, calories) of every new calorie entry, added to the totals together
+    for result, kind, values in pending:
+        if result["key"] in seen: #Already saved by an earlier sync, or repeated in this one
+            result["status"] = "duplicate"
+            continue
+        seen.add(result["key"])
+        db.session.add(KINDS[kind]["model"](user_id = user_id, **values))
+        db.session.add(SyncReceipt(user_id = user_id, idempotency_key = result["key"], kind = kind))
+        if kind == "calories":
+            meals.append((values["entry_date"], values["calories"]))
+        result["status"] = "created"
+    if meals:
+        apply_entries(db.session, user_id, timezone_name, meals) #Updates the daily and weekly totals in the same transaction
+    if any(result.get("status") == "created" for result, kind, values in pending):
+        touch_user(db.session, user_id)
+    db.session.commit()
@@ -0,0 +1,180 @@
+import json #The top exercises and recent reviews are stored as JSON text
+import threading #Runs the reconciliation in the background
+import time #Waits between reconciliations and times them
+from datetime import datetime #Records when the totals were last recalculated
+from sqlalchemy import text, bindparam #text: Allows raw SQL statements to be run through SQLAlchemy. bindparam: Lets a list of trainer ids be bound to one IN (...)
+from sqlalchemy.dialects.sqlite import insert #SQLite's INSERT, which supports "ON CONFLICT DO UPDATE" (an upsert)
+from DB_Models import db, User, TrainerStats #The table the totals are saved to
+from Ratings import STARS, rating_stars #The rule for which star a rating counts towards, shared with the exercise rating summaries
+
+TOP_STORED = 10 #How many top exercises are stored. The dashboard shows TOP_SHOWN, the rest stand in if one of those drops down before the next reconciliation
+TOP_SHOWN = 5 #How many top exercises the dashboard shows
+RECENT_STORED = 10 #How many recent reviews are stored and shown
+RECONCILE_BATCH = 50 #How many trainers are recalculated in each write transaction
+
+def _rank(entry): #How the top exercises are ordered: most favourites, then most reviews, then best average rating. Matches the ORDER BY in reconcile_trainer_stats
+    return (-entry["favourites"], -entry["reviews"], -(entry["rating_average"] or 0), entry["id"])
+
+def _add(executor, trainer_id, **counts): #Adds to the trainer's totals, creating their row if it doesn't exist yet
+    statement = insert(TrainerStats).values(trainer_id = trainer_id, **counts)
+    statement = statement.on_conflict_do_update(index_elements = [TrainerStats.trainer_id], set_ = {column: getattr(TrainerStats, column) + value for column, value in counts.items()}) #Counted inside the database, so two changes saved at the same time can't overwrite each other
+    executor.execute(statement)
+
+def _update_list(executor, trainer_id, column, update): #Reads one of the trainer's JSON lists, changes it with update(list) and saves it again. Runs in the caller's write transaction
+    current = executor.execute(text(f"SELECT {column} FROM trainer_stats WHERE trainer_id = :trainer_id"), {"trainer_id": trainer_id}).scalar()
+    executor.execute(text(f"UPDATE trainer_stats SET {column} = :value WHERE trainer_id = :trainer_id"), {"trainer_id": trainer_id, "value": json.dumps(update(json.loads(current or "[]")))})
+
+def _refresh_top(executor, trainer_id, exercise_id, name): #Puts the exercise's new totals into the trainer's top exercises. Costs one index lookup for the favourites and one for the rating summary
+    favourites = executor.execute(text("SELECT COUNT(*) FROM favourite__exercise WHERE exercise_id = :exercise_id"), {"exercise_id": exercise_id}).scalar()
+    summary = executor.execute(text("SELECT review_count, rating_sum FROM exercise_rating_summary WHERE exercise_id = :exercise_id"), {"exercise_id": exercise_id}).first()
+    reviews = summary.review_count if summary else 0
+    entry = {"id": exercise_id, "name": name, "favourites": favourites, "reviews": reviews, "rating_average": summary.rating_sum / reviews if reviews else None}
+    def update(top):
+        top = [item for item in top if item["id"] != exercise_id] + [entry]
+        return sorted(top, key = _rank)[:TOP_STORED]
+    _update_list(executor, trainer_id, "top_exercises", update)
+
+def _exercise(executor, exercise_id): #The trainer and name of an exercise
+    return executor.execute(text("SELECT trainer_id, name FROM exercise WHERE id = :exercise_id"), {"exercise_id": exercise_id}).first()
+
+def exercise_added(executor, trainer_id): #Called in the same transaction as a new exercise
+    _add(executor, trainer_id, exercise_count = 1)
+
+def favourite_changed(executor, exercise_id, sign): #Called in the same transaction as a favourite being added (sign 1) or removed (sign -1)
+    exercise = _exercise(executor, exercise_id)
+    if exercise is None:
+        return
+    _add(executor, exercise.trainer_id, favourite_count = sign)
+    _refresh_top(executor, exercise.trainer_id, exercise_id, exercise.name)
+
+def review_added(db_session, review): #Called in the same transaction as a new review, once it has been added to the session
+    db_session.flush() #Gives the review its created_at time
+    exercise = _exercise(db_session, review.exercise_id)
+    if exercise is None:
+        return
+    stars = rating_stars(review.rating)
+    _add(db_session, exercise.trainer_id, review_count = 1, rating_sum = stars, **{f"star_{stars}": 1})
+    recent = {"exercise_id": review.exercise_id, "exercise_name": exercise.name, "username": db_session.get(User, review.user_id).username, "rating": review.rating, "comment": review.comment, "created_at": str(review.created_at)}
+    _update_list(db_session, exercise.trainer_id, "recent_reviews", lambda reviews: ([recent] + reviews)[:RECENT_STORED])
+    _refresh_top(db_session, exercise.trainer_id, review.exercise_id, exercise.name)
+
+def _trainer_ids(executor): #Every trainer: every account that isn't a gym goer (the same check as the trainer dashboard, registration saves trainers with the role "trainer"), plus anyone who owns exercises, diets or routines
+    return {row[0] for row in executor.execute(text("""
+        SELECT id FROM user WHERE role != 'gym_goer'
+        UNION SELECT trainer_id FROM exercise UNION SELECT trainer_id FROM diets UNION SELECT trainer_id FROM workout_routine
+    """))}
+
+def reconcile_trainer_stats(executor, trainer_ids = None): #Recalculates the totals of the given trainers (or, with no trainer_ids, every trainer) from the tables, fixing anything the incremental updates missed (such as an exercise dropping out of the top list, or diets and routines added outside the app). Returns how many trainers were recalculated
+    only = "IN :trainer_ids" if trainer_ids is not None else "IS NOT NULL" #Limits every query below to the chosen trainers
+    def run(sql, **parameters):
+        statement = text(sql)
+        if trainer_ids is not None:
+            statement = statement.bindparams(bindparam("trainer_ids", expanding = True))
+            parameters["trainer_ids"] = list(trainer_ids)
+        return executor.execute(statement, parameters)
+    run(f"DELETE FROM trainer_stats WHERE trainer_id {only}") #Deleting first takes SQLite's write lock, so no other change to these trainers can be saved between the reads below and the new rows
+    def grouped(sql, **parameters): #Runs a query grouped by trainer and returns {trainer_id: the other columns}
+        return {row[0]: row[1:] for row in run(sql, **parameters)}
+    exercises = grouped(f"SELECT trainer_id, COUNT(*) FROM exercise WHERE trainer_id {only} GROUP BY trainer_id")
+    favourites = grouped(f"SELECT e.trainer_id, COUNT(*) FROM exercise e JOIN favourite__exercise f ON f.exercise_id = e.id WHERE e.trainer_id {only} GROUP BY e.trainer_id")
+    reviews = grouped(f"""
+        SELECT trainer_id, COUNT(*), SUM(stars), SUM(stars = 1), SUM(stars = 2), SUM(stars = 3), SUM(stars = 4), SUM(stars = 5)
+        FROM (SELECT e.trainer_id, {STARS} AS stars FROM exercise e JOIN review__exercise r ON r.exercise_id = e.id WHERE e.trainer_id {only})
+        GROUP BY trainer_id
+    """)
+    diets = grouped(f"SELECT trainer_id, COUNT(*) FROM diets WHERE trainer_id {only} GROUP BY trainer_id")
+    routines = grouped(f"SELECT trainer_id, COUNT(*) FROM workout_routine WHERE trainer_id {only} GROUP BY trainer_id")
+    top = {}
+    for row in run(f"""
+        SELECT trainer_id, id, name, favourites, reviews, rating_average FROM (
+            SELECT trainer_id, id, name, favourites, reviews, rating_average,
+                   ROW_NUMBER() OVER (PARTITION BY trainer_id ORDER BY favourites DESC, reviews DESC, COALESCE(rating_average, 0) DESC, id) AS position
+            FROM (
+                SELECT e.trainer_id, e.id, e.name, (SELECT COUNT(*) FROM favourite__exercise f WHERE f.exercise_id = e.id) AS favourites,
+                       COALESCE(s.review_count, 0) AS reviews, s.rating_sum * 1.0 / NULLIF(s.review_count, 0) AS rating_average
+                FROM exercise e LEFT JOIN exercise_rating_summary s ON s.exercise_id = e.id
+                WHERE e.trainer_id {only}
+            )
+        ) WHERE position <= :top ORDER BY trainer_id, position
+    """, top = TOP_STORED).mappings(): #Each exercise's favourites are counted through the favourite index, so only the chosen trainers' exercises are read
+        top.setdefault(row["trainer_id"], []).append({key: row[key] for key in ("id", "name", "favourites", "reviews", "rating_average")})
+    recent = {}
+    for row in run(f"""
+        SELECT trainer_id, exercise_id, exercise_name, username, rating, comment, created_at FROM (
+            SELECT e.trainer_id, r.exercise_id, e.name AS exercise_name, u.username, r.rating, r.comment, r.created_at,
+                   ROW_NUMBER() OVER (PARTITION BY e.trainer_id ORDER BY r.created_at DESC, r.id DESC) AS position
+            FROM exercise e JOIN review__exercise r ON r.exercise_id = e.id JOIN user u ON u.id = r.user_id
+            WHERE e.trainer_id {only}
+        ) WHERE position <= :recent ORDER BY trainer_id, position
+    """, recent = RECENT_STORED).mappings():
+        recent.setdefault(row["trainer_id"], []).append({key: row[key] for key in ("exercise_id", "exercise_name", "username", "rating", "comment", "created_at")})
+    if trainer_ids is None:
+        trainer_ids = _trainer_ids(executor)
+    now = datetime.utcnow()
+    rows = []
+    for trainer_id in sorted(trainer_ids):
+        review_count, rating_sum, *stars = reviews.get(trainer_id, (0, 0, 0, 0, 0, 0, 0))
+        rows.append({
+            "trainer_id": trainer_id,
+            "exercise_count": exercises.get(trainer_id, (0, ))[0],
+            "favourite_count": favourites.get(trainer_id, (0, ))[0],
+            "review_count": review_count,
+            "rating_sum": rating_sum,
+            **{f"star_{index + 1}": count for index, count in enumerate(stars)},
+            "diet_count": diets.get(trainer_id, (0, ))[0],
+            "routine_count": routines.get(trainer_id, (0, ))[0],
+            "top_exercises": json.dumps(top.get(trainer_id, [])),
+            "recent_reviews": json.dumps(recent.get(trainer_id, [])),
+            "reconciled_at": now,
+        })
+    if rows:
+        executor.execute(insert(TrainerStats), rows)
+    return len(rows)
+
+def reconcile_in_batches(db_session, batch_size = RECONCILE_BATCH): #Recalculates every trainer's totals batch_size trainers at a time, committing each batch. A batch only holds SQLite's write lock while its own trainers' rows are added up, so requests saving changes never wait behind the whole catalogue. Used by the background job and "flask --app App reconcile-trainer-stats"
+    trainer_ids = sorted(_trainer_ids(db_session))
+    db_session.commit()
+    for start in range(0, len(trainer_ids), batch_size):
+        reconcile_trainer_stats(db_session, trainer_ids[start:start + batch_size])
+        db_session.commit()
+    return len(trainer_ids)
+
+class StatsReconciler: #Recalculates the trainer totals every interval seconds in a background thread. Every worker process that turns it on runs its own, so it is meant for single-worker setups. With several workers, run "flask --app App reconcile-trainer-stats" from cron instead
+    def __init__(self, app, interval):
+        self.app = app #The thread needs the app to use the database
+        self.interval = interval #Seconds between reconciliations
+        self._thread = None
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.failures = 0
+        self.last_duration = 0.0
+
+    def start(self): #Starts the thread if it isn't running. Cheap enough to call on every request
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target = self._run, name = "trainer-stats", daemon = True)
+                self._thread.start()
+
+    def run_once(self): #Recalculates the totals once
+        start = time.perf_counter()
+        with self.app.app_context():
+            try:
+                reconcile_in_batches(db.session) #Commits each batch of trainers
+                self.runs += 1
+            except Exception: #A failed run is logged and tried again after the next interval
+                db.session.rollback()
+                self.failures += 1
+                self.app.logger.exception("Reconciling trainer stats failed")
+            finally:
+                db.session.remove() #Gives the connection back to the pool
+        self.last_duration = time.perf_counter() - start
+
+    def _run(self): #The background thread: waits, reconciles, forever
+        while True:
+            time.sleep(self.interval)
+            self.run_once()
+
+    def stats(self): #How many reconciliations have run, failed, and how long the last one took
+        return {"runs": self.runs, "failures": self.failures, "last_duration_seconds": self.last_duration}
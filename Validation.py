@@ -0,0 +1,59 @@
+#Checks for the data users submit. The form routes in App.py and the bulk import in Bulk_IO.py both use these so a row is accepted or rejected by the same rules either way.
+#Each function returns (values, None) when the data is valid, or (None, error message) when it isn't.
+import math #Spots "nan" and "inf", which float() accepts but can't be saved or sent as JSON
+
+#The largest value accepted for each number. Far above anything a real workout or meal needs, and well inside the 64-bit integers SQLite can store, so an absurd value is a validation error for that row rather than a database error for the whole request
+MAX_SETS = 10000
+MAX_REPS = 100000
+MAX_WEIGHT = 100000
+MAX_CALORIES = 1000000
+
+def validate_workout(data): #Checks a workout's exercise, sets, reps and weight
+    exercise = data.get("exercise")
+    sets = data.get("sets")
+    reps = data.get("reps")
+    weight = data.get("weight")
+    if not exercise or any(value in (None, "") for value in (sets, reps, weight)): #Stops empty submissions to prevent incomplete database records. A number 0 from an import still counts as filled in
+        return None, "Please fill in all the fields"
+    if not isinstance(exercise, str): #JSON from an import or a sync could send a list or object, which can't be saved as the name
+        return None, "Exercise must be text"
+    try:
+        sets = int(sets)
+        reps = int(reps)
+        weight = float(weight)
+    except (TypeError, ValueError, OverflowError): #Stops text being saved where a number is expected. int() of an infinite float from JSON raises OverflowError
+        return None, "Sets, reps and weight must be numbers"
+    if not math.isfinite(weight): #float() accepts "nan" and "inf"
+        return None, "Sets, reps and weight must be numbers"
+    if sets < 0:
+        return None, "Sets must be positive"
+    if reps < 0:
+        return None, "Reps must be positive"
+    if weight < 0:
+        return None, "Weight must be positive"
+    if sets > MAX_SETS:
+        return None, f"Sets must be at most {MAX_SETS}"
+    if reps > MAX_REPS:
+        return None, f"Reps must be at most {MAX_REPS}"
+    if weight > MAX_WEIGHT:
+        return None, f"Weight must be at most {MAX_WEIGHT}"
+    return {"exercise": exercise, "sets": sets, "reps": reps, "weight": weight}, None
+
+def validate_calories(data): #Checks a calorie entry's meal and calories
+    meal = data.get("meal")
+    calories = data.get("calories")
+    if calories in (None, "") or not meal: #Stops empty submissions to prevent incomplete database records. A number 0 from an import still counts as filled in
+        return None, "Please fill in all the fields"
+    if not isinstance(meal, str): #JSON from an import or a sync could send a list or object, which can't be saved as the meal
+        return None, "Meal must be text"
+    try:
+        calories = float(calories)
+    except (TypeError, ValueError, OverflowError): #Stops text being saved where a number is expected. A huge integer from JSON can't be turned into a float
+        return None, "Calories must be a number"
+    if not math.isfinite(calories): #float() accepts "nan" and "inf"
+        return None, "Calories must be a number"
+    if calories < 0:
+        return None, "Calories must be positive"
+    if calories > MAX_CALORIES:
+        return None, f"Calories must be at most {MAX_CALORIES}"
+    return {"meal": meal, "calories": calories}, None
@@ -0,0 +1,170 @@
+//The Fit & Fresh service worker. It keeps a copy of the app's pages so they open without a connection, and queues workouts and calorie entries logged while offline so they can be sent to /api/sync in one request once the connection is back.
+const CACHE_NAME = "fit-fresh-shell-v2"; //Changing the version makes every browser download a fresh copy of the pages. v2 drops pages saved before the log forms recorded their user
+const PRECACHE_URLS = ["/", "/login", "/register", "/manifest.json"]; //Pages that can be saved when the service worker is installed because they don't need the user to be logged in
+const QUEUED_ROUTES = {"/log-workout": "workout", "/log-calories": "calories"}; //Form submissions that are queued when offline, and the kind of entry each one creates
+const ACCOUNT_ROUTES = {"POST /login": "login", "GET /logout": "logout"}; //Requests that change who is logged in. The saved pages belong to the previous user, so they are deleted
+const DB_NAME = "fit-fresh-offline"; //The IndexedDB database that holds the queue
+const STORE_NAME = "queue"; //The object store inside it
+const SYNC_TAG = "fit-fresh-sync"; //The name used for background sync
+const SYNC_BATCH_SIZE = 100; //How many queued entries are sent in each /api/sync request
+
+self.addEventListener("install", (event) => { //Saves the pages that don't need a login as soon as the service worker is installed
+    event.waitUntil(caches.open(CACHE_NAME).then((cache) => cache.addAll(PRECACHE_URLS)).then(() => self.skipWaiting()));
+});
+
+self.addEventListener("activate", (event) => { //Deletes caches left by older versions and tries to send anything still queued
+    event.waitUntil(
+        caches.keys()
+            .then((names) => Promise.all(names.filter((name) => name !== CACHE_NAME).map((name) => caches.delete(name))))
+            .then(() => self.clients.claim())
+            .then(() => flushQueue())
+    );
+});
+
+self.addEventListener("fetch", (event) => { //Runs for every request the pages make
+    const url = new URL(event.request.url);
+    if (url.origin !== self.location.origin) { //Requests to other sites are left alone
+        return;
+    }
+    const account = ACCOUNT_ROUTES[`${event.request.method} ${url.pathname}`];
+    if (account) {
+        event.respondWith(changeAccount(event.request, account));
+    } else if (event.request.method === "POST" && QUEUED_ROUTES[url.pathname]) {
+        event.respondWith(submitOrQueue(event.request, QUEUED_ROUTES[url.pathname]));
+    } else if (event.request.method === "GET") {
+        event.respondWith(networkFirst(event.request));
+    }
+});
+
+self.addEventListener("sync", (event) => { //Background sync: the browser wakes the service worker when the connection comes back
+    if (event.tag === SYNC_TAG) {
+        event.waitUntil(flushQueue());
+    }
+});
+
+self.addEventListener("message", (event) => { //Pages send "flush" when the browser goes back online, for browsers without background sync
+    if (event.data === "flush") {
+        event.waitUntil(flushQueue());
+    }
+});
+
+async function networkFirst(request) { //Tries the network first so pages are always up to date, and falls back to the saved copy when offline
+    const cache = await caches.open(CACHE_NAME);
+    try {
+        const response = await fetch(request);
+        const isPage = (response.headers.get("Content-Type") || "").startsWith("text/html"); //Only pages are saved, not exports or JSON
+        if (response.ok && !response.redirected && isPage) { //Keeps a copy of every page that loaded properly (redirects to the home page aren't saved in place of the page that was asked for)
+            cache.put(request, response.clone());
+        }
+        return response;
+    } catch (error) {
+        const cached = await cache.match(request);
+        return cached || new Response("You are offline and this page hasn't been saved yet.", {status: 503, headers: {"Content-Type": "text/plain"}});
+    }
+}
+
+async function changeAccount(request, account) { //Logs in or out, then deletes the saved pages so the next person can't open them offline
+    if (account === "logout") { //Sends anything still queued while the user is logged in
+        await flushQueue();
+    }
+    const response = await fetch(request);
+    await clearPages();
+    return response;
+}
+
+async function clearPages() { //Deletes every saved page except the ones that don't need a login
+    const cache = await caches.open(CACHE_NAME);
+    const requests = await cache.keys();
+    await Promise.all(requests.filter((request) => !PRECACHE_URLS.includes(new URL(request.url).pathname)).map((request) => cache.delete(request)));
+}
+
+async function submitOrQueue(request, kind) { //Sends a workout or calorie form normally, or saves it to the queue if there is no connection
+    const queuedCopy = request.clone(); //A request body can only be read once, so a copy is kept for the queue
+    try {
+        return await fetch(request);
+    } catch (error) {
+        const data = Object.fromEntries((await queuedCopy.formData()).entries());
+        const userId = Number(data.user_id) || null; //The user the form was shown to. It's only used to decide when the entry can be sent
+        delete data.user_id;
+        await enqueue({key: crypto.randomUUID(), user_id: userId, kind: kind, data: data, logged_at: new Date().toISOString()}); //The random key lets the server ignore the entry if it is ever sent twice
+        if (self.registration.sync) { //Asks the browser to wake the service worker when the connection is back
+            await self.registration.sync.register(SYNC_TAG).catch(() => {});
+        }
+        return new Response(
+            "<p>You're offline. Your entry has been saved and will be sent when you're back online.</p><a href=\"/\">Back to Home</a>",
+            {status: 202, headers: {"Content-Type": "text/html"}}
+        );
+    }
+}
+
+function openQueue() { //Opens (and the first time, creates) the IndexedDB database that holds the queue
+    return new Promise((resolve, reject) => {
+        const request = indexedDB.open(DB_NAME, 1);
+        request.onupgradeneeded = () => request.result.createObjectStore(STORE_NAME, {keyPath: "key"});
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+async function runTransaction(mode, work) { //Runs work(store) inside an IndexedDB transaction and waits for it to finish
+    const database = await openQueue();
+    return new Promise((resolve, reject) => {
+        const transaction = database.transaction(STORE_NAME, mode);
+        const result = work(transaction.objectStore(STORE_NAME));
+        transaction.oncomplete = () => resolve(result && result.result);
+        transaction.onerror = () => reject(transaction.error);
+    });
+}
+
+function enqueue(entry) { //Adds one entry to the queue
+    return runTransaction("readwrite", (store) => store.put(entry));
+}
+
+function readQueue() { //Returns every queued entry
+    return runTransaction("readonly", (store) => store.getAll());
+}
+
+function removeFromQueue(keys) { //Removes the entries the server has dealt with
+    return runTransaction("readwrite", (store) => keys.forEach((key) => store.delete(key)));
+}
+
+let flushing = null; //The flush that is currently running, so two flushes never send the same entries at once
+
+function flushQueue() { //Sends the queue to /api/sync in batches
+    if (!flushing) {
+        flushing = sendQueue().finally(() => { flushing = null; });
+    }
+    return flushing;
+}
+
+async function sendQueue() { //Sends each user's entries separately. The server refuses entries made by anyone but the logged-in user, and those are kept until that user logs in again
+    const entries = await readQueue();
+    const ownerless = entries.filter((entry) => !entry.user_id).map((entry) => entry.key);
+    if (ownerless.length) { //Queued before entries recorded their user. They can't be matched to an account, so they are dropped rather than risk saving them to the wrong one
+        await removeFromQueue(ownerless);
+    }
+    const byUser = new Map();
+    entries.filter((entry) => entry.user_id).forEach((entry) => byUser.set(entry.user_id, [...(byUser.get(entry.user_id) || []), entry]));
+    for (const [userId, userEntries] of byUser) {
+        for (let start = 0; start < userEntries.length; start += SYNC_BATCH_SIZE) {
+            const batch = userEntries.slice(start, start + SYNC_BATCH_SIZE).map(({user_id, ...entry}) => entry);
+            let response;
+            try {
+                response = await fetch("/api/sync", {
+                    method: "POST",
+                    credentials: "same-origin", //Sends the login cookie so the server knows who is logged in
+                    headers: {"Content-Type": "application/json"},
+                    body: JSON.stringify({user_id: userId, entries: batch}),
+                });
+            } catch (error) {
+                return; //Still offline. The queue is kept for the next try
+            }
+            if (!response.ok) { //Not logged in, logged in as someone else (409), or the server had a problem. This user's entries are kept for the next try
+                break;
+            }
+            const body = await response.json();
+            //Created and duplicate entries are saved on the server, and invalid ones will never be accepted, so all of them are removed from the queue
+            await removeFromQueue(body.results.map((result) => result.key).filter((key) => key));
+        }
+    }
+}